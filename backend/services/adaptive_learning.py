@@ -1,12 +1,23 @@
 import sqlite3
 import random
+import threading
 from datetime import datetime, timedelta
+from operator import itemgetter
+from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+from services.performance_tracker import MASTERY_CASE
+
+_PRIORITY_ORDER = {"high": 3, "medium": 2, "low": 1}
+
 class AdaptiveLearningEngine:
     
     def __init__(self, db_path: str = 'study_assistant.db'):
         self.db_path = db_path
+        self._local = threading.local()
+        # Every thread's read-only connection, so close() can reach them all
+        self._ro_conns: List[sqlite3.Connection] = []
+        self._ro_lock = threading.Lock()
         
         self.difficulty_levels = {
             1: {"name": "Beginner", "multiplier": 0.8, "time_bonus": 1.2},
@@ -15,9 +26,64 @@ class AdaptiveLearningEngine:
             4: {"name": "Hard", "multiplier": 1.2, "time_bonus": 0.9},
             5: {"name": "Expert", "multiplier": 1.5, "time_bonus": 0.8}
         }
+        
+        # "mastery_level" once PerformanceTracker's generated column is seen
+        self._mastery_expr = None
     
-    def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+    def _mastery_column(self, conn) -> str:
+        """The generated mastery_level column if the schema has it, else the equivalent inline CASE"""
+        if self._mastery_expr is None:
+            columns = {row["name"] for row in conn.execute("PRAGMA table_xinfo(flashcard_performance)")}
+            if "mastery_level" not in columns:
+                return MASTERY_CASE
+            self._mastery_expr = "mastery_level"
+        return self._mastery_expr
+    
+    def _get_connection(self, readonly: bool = False):
+        if readonly:
+            # One long-lived read-only connection per thread; callers must not close it
+            conn = getattr(self._local, "ro_conn", None)
+            if conn is not None and self._local.stand_in and Path(self.db_path).exists():
+                # The database has been created since; swap in a real read-only connection
+                with self._ro_lock:
+                    self._ro_conns.remove(conn)
+                conn.close()
+                conn = None
+            if conn is None:
+                conn = self._open_readonly_connection()
+                self._local.stand_in = conn is None
+                if conn is None:
+                    # Database file not created yet: an empty in-memory database stands in
+                    # (queries see no tables, as with a fresh file) without creating the file
+                    conn = sqlite3.connect(":memory:", check_same_thread=False)
+                    conn.row_factory = sqlite3.Row
+                self._local.ro_conn = conn
+                with self._ro_lock:
+                    self._ro_conns.append(conn)
+            return conn
+        
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def _open_readonly_connection(self) -> Optional[sqlite3.Connection]:
+        try:
+            # close() may run on another thread than the one that opened the connection
+            conn = sqlite3.connect(f"{Path(self.db_path).resolve().as_uri()}?mode=ro", uri=True,
+                                   check_same_thread=False)
+        except sqlite3.OperationalError:
+            return None
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def close(self):
+        """Close every thread's cached read-only connection"""
+        with self._ro_lock:
+            conns, self._ro_conns = self._ro_conns, []
+        for conn in conns:
+            conn.close()
+        # Threads reopen on next use rather than reuse a closed connection
+        self._local = threading.local()
     
     def adjust_flashcard_difficulty(self, session_id: str, cards: List[Dict], 
                                    current_level: str = "medium") -> List[Dict]:
@@ -31,6 +97,8 @@ class AdaptiveLearningEngine:
         # Determine optimal difficulty
         optimal_difficulty = self._calculate_optimal_difficulty(performance_stats)
         
+        now = datetime.now()
+        
         # Apply difficulty adjustments to cards
         adjusted_cards = []
         for card in cards:
@@ -59,20 +127,21 @@ class AdaptiveLearningEngine:
                 adjusted_card["difficulty_level"] = optimal_difficulty
                 adjusted_card["review_priority"] = "medium"
             
+            adjusted_card["_prio"] = _PRIORITY_ORDER[adjusted_card["review_priority"]]
+            
             # Add spaced repetition metadata
             adjusted_card["next_review"] = self._calculate_next_review_time(
                 term_performance.get("retention_score", 2.0) if term_performance else 2.0,
-                adjusted_card["difficulty_level"]
+                adjusted_card["difficulty_level"],
+                now
             ).isoformat()
             
             adjusted_cards.append(adjusted_card)
         
         # Sort by priority (high priority first)
-        priority_order = {"high": 3, "medium": 2, "low": 1}
-        adjusted_cards.sort(
-            key=lambda x: priority_order.get(x.get("review_priority", "medium"), 2),
-            reverse=True
-        )
+        adjusted_cards.sort(key=itemgetter("_prio"), reverse=True)
+        for adjusted_card in adjusted_cards:
+            del adjusted_card["_prio"]
         
         return adjusted_cards
     
@@ -117,57 +186,57 @@ class AdaptiveLearningEngine:
         accuracy = results.get("accuracy", 0)
         avg_time = results.get("average_time", 30)
         question_results = results.get("question_results", [])
+        now = datetime.now()
         
         recommendations = {
             "next_difficulty": self._recommend_next_difficulty(accuracy, avg_time),
             "focus_areas": self._identify_focus_areas(question_results),
             "study_plan": self._generate_study_plan(session_id, accuracy, question_results),
             "motivation_message": self._get_motivation_message(accuracy),
-            "streak_info": self._calculate_streak_info(session_id)
+            "streak_info": self._calculate_streak_info(session_id, now)
         }
         
         return recommendations
     
     def get_next_review_recommendations(self, session_id: str) -> List[Dict]:
         """Get terms that are due for review (spaced repetition)"""
-        conn = self._get_connection()
+        conn = self._get_connection(readonly=True)
         cursor = conn.cursor()
         
         now = datetime.now()
         
         # Get terms due for review
         cursor.execute('''
-            SELECT term, difficulty_level, retention_score, attempts, correct_answers, next_review
+            SELECT term, difficulty_level, retention_score, next_review,
+                   CAST(correct_answers AS FLOAT) / MAX(attempts, 1) AS accuracy
             FROM flashcard_performance
             WHERE session_id = ? AND next_review <= ?
             ORDER BY next_review ASC, retention_score ASC
             LIMIT 10
         ''', (session_id, now))
         
-        due_reviews = []
-        for row in cursor.fetchall():
-            term, difficulty, retention_score, attempts, correct, next_review = row
-            accuracy = correct / max(attempts, 1)
-            
-            due_reviews.append({
-                "term": term,
-                "difficulty_level": difficulty,
-                "retention_score": round(retention_score, 2),
-                "accuracy": round(accuracy, 2),
-                "urgency": self._calculate_review_urgency(next_review, retention_score),
-                "estimated_time": int(30 * (difficulty / 3))  # Estimated time in seconds
-            })
+        due_reviews = [
+            {
+                "term": r["term"],
+                "difficulty_level": r["difficulty_level"],
+                "retention_score": round(r["retention_score"], 2),
+                "accuracy": round(r["accuracy"], 2),
+                "urgency": self._calculate_review_urgency(r["next_review"], r["retention_score"], now),
+                "estimated_time": int(30 * (r["difficulty_level"] / 3))  # Estimated time in seconds
+            }
+            for r in cursor.fetchall()
+        ]
         
-        conn.close()
         return due_reviews
     
     def get_learning_insights(self, session_id: str) -> Dict:
         """Generate learning insights similar to Duolingo's insights"""
-        conn = self._get_connection()
+        conn = self._get_connection(readonly=True)
         cursor = conn.cursor()
         
         # Get recent activity (last 7 days)
-        week_ago = datetime.now() - timedelta(days=7)
+        now = datetime.now()
+        week_ago = now - timedelta(days=7)
         
         cursor.execute('''
             SELECT DATE(timestamp) as day, COUNT(*) as questions
@@ -180,7 +249,7 @@ class AdaptiveLearningEngine:
         daily_activity = cursor.fetchall()
         
         # Calculate streak
-        current_streak = self._calculate_current_streak(session_id)
+        current_streak = self._calculate_current_streak(session_id, now)
         
         # Get learning velocity
         cursor.execute('''
@@ -195,23 +264,15 @@ class AdaptiveLearningEngine:
         recent_stats = cursor.fetchone()
         
         # Get mastery distribution
-        cursor.execute('''
-            SELECT 
-                CASE 
-                    WHEN CAST(correct_answers AS FLOAT) / attempts >= 0.9 THEN 'mastered'
-                    WHEN CAST(correct_answers AS FLOAT) / attempts >= 0.7 THEN 'learning'
-                    ELSE 'struggling'
-                END as mastery_level,
-                COUNT(*) as count
+        cursor.execute(f'''
+            SELECT {self._mastery_column(conn)} as mastery, COUNT(*) as count
             FROM flashcard_performance
             WHERE session_id = ?
-            GROUP BY mastery_level
+            GROUP BY mastery
         ''', (session_id,))
         
         mastery_distribution = {row[0]: row[1] for row in cursor.fetchall()}
         
-        conn.close()
-        
         # Generate insights
         insights = {
             "current_streak": current_streak,
@@ -288,11 +349,17 @@ class AdaptiveLearningEngine:
                 "action": "Continue streak"
             })
         
-        return sorted(recommendations, key=lambda x: {"high": 3, "medium": 2, "low": 1}[x["priority"]], reverse=True)
+        for rec in recommendations:
+            rec["_prio"] = _PRIORITY_ORDER[rec["priority"]]
+        recommendations.sort(key=itemgetter("_prio"), reverse=True)
+        for rec in recommendations:
+            del rec["_prio"]
+        
+        return recommendations
     
     def _get_user_performance_stats(self, session_id: str) -> Dict:
         """Get comprehensive user performance statistics"""
-        conn = self._get_connection()
+        conn = self._get_connection(readonly=True)
         cursor = conn.cursor()
         
         # Quiz performance
@@ -320,8 +387,6 @@ class AdaptiveLearningEngine:
         
         flashcard_stats = cursor.fetchone()
         
-        conn.close()
-        
         return {
             "avg_accuracy": quiz_stats[0] or 0,
             "avg_response_time": quiz_stats[1] or 30,
@@ -337,7 +402,7 @@ class AdaptiveLearningEngine:
         if not term:
             return None
             
-        conn = self._get_connection()
+        conn = self._get_connection(readonly=True)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -347,7 +412,6 @@ class AdaptiveLearningEngine:
         ''', (session_id, term))
         
         result = cursor.fetchone()
-        conn.close()
         
         if result:
             attempts, correct, retention, difficulty, last_reviewed = result
@@ -390,7 +454,8 @@ class AdaptiveLearningEngine:
         
         return max(1, min(5, base_difficulty))
     
-    def _calculate_next_review_time(self, retention_score: float, difficulty_level: int) -> datetime:
+    def _calculate_next_review_time(self, retention_score: float, difficulty_level: int,
+                                    now: datetime) -> datetime:
         """Calculate next review time using spaced repetition (SM-2 inspired algorithm)"""
         # Base interval in hours
         base_interval = 24  # 1 day
@@ -401,12 +466,12 @@ class AdaptiveLearningEngine:
         # Cap the interval (max 30 days)
         interval_hours = min(interval_hours, 24 * 30)
         
-        return datetime.now() + timedelta(hours=interval_hours)
+        return now + timedelta(hours=interval_hours)
     
-    def _calculate_review_urgency(self, next_review_str: str, retention_score: float) -> str:
+    def _calculate_review_urgency(self, next_review_str: str, retention_score: float,
+                                  now: datetime) -> str:
         """Calculate how urgent a review is"""
         next_review = datetime.fromisoformat(next_review_str)
-        now = datetime.now()
         
         hours_overdue = (now - next_review).total_seconds() / 3600
         
@@ -419,9 +484,9 @@ class AdaptiveLearningEngine:
         else:
             return "low"
     
-    def _calculate_current_streak(self, session_id: str) -> int:
+    def _calculate_current_streak(self, session_id: str, now: datetime) -> int:
         """Calculate current daily study streak"""
-        conn = self._get_connection()
+        conn = self._get_connection(readonly=True)
         cursor = conn.cursor()
         
         # Get distinct study days ordered by date (most recent first)
@@ -433,13 +498,12 @@ class AdaptiveLearningEngine:
         ''', (session_id,))
         
         study_days = [row[0] for row in cursor.fetchall()]
-        conn.close()
         
         if not study_days:
             return 0
         
         streak = 0
-        today = datetime.now().date()
+        today = now.date()
         
         for i, day_str in enumerate(study_days):
             day = datetime.fromisoformat(day_str).date()
@@ -484,22 +548,18 @@ class AdaptiveLearningEngine:
     
     def _identify_focus_areas(self, question_results: List[Dict]) -> List[str]:
         """Identify areas that need more focus"""
-        focus_areas = []
+        if not question_results:
+            return []
         
-        # Group by difficulty and analyze performance
-        difficulty_performance = {}
+        # Per-difficulty [hits, attempts] in a single pass, in first-seen order; difficulty
+        # values come from the client, so they are grouped as given rather than assumed to be ints
+        counts: Dict = {}
         for result in question_results:
-            difficulty = result.get("difficulty", 3)
-            if difficulty not in difficulty_performance:
-                difficulty_performance[difficulty] = []
-            difficulty_performance[difficulty].append(result["is_correct"])
+            tally = counts.setdefault(result.get("difficulty", 3), [0, 0])
+            tally[0] += result["is_correct"]
+            tally[1] += 1
         
-        for difficulty, results in difficulty_performance.items():
-            accuracy = sum(results) / len(results)
-            if accuracy < 0.6:
-                focus_areas.append(f"Difficulty level {difficulty}")
-        
-        return focus_areas
+        return [f"Difficulty level {d}" for d, (hits, total) in counts.items() if hits / total < 0.6]
     
     def _generate_study_plan(self, session_id: str, accuracy: float, question_results: List[Dict]) -> Dict:
         """Generate a personalized study plan"""
@@ -553,12 +613,12 @@ class AdaptiveLearningEngine:
         
         return random.choice(messages)
     
-    def _calculate_streak_info(self, session_id: str) -> Dict:
+    def _calculate_streak_info(self, session_id: str, now: datetime) -> Dict:
         """Calculate streak information"""
-        current_streak = self._calculate_current_streak(session_id)
+        current_streak = self._calculate_current_streak(session_id, now)
         
         # Get longest streak
-        conn = self._get_connection()
+        conn = self._get_connection(readonly=True)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -569,7 +629,6 @@ class AdaptiveLearningEngine:
         ''', (session_id,))
         
         all_days = [datetime.fromisoformat(row[0]).date() for row in cursor.fetchall()]
-        conn.close()
         
         longest_streak = 0
         current_count = 1
@@ -598,10 +657,10 @@ class AdaptiveLearningEngine:
     
     def _calculate_learning_momentum(self, session_id: str) -> str:
         """Calculate learning momentum trend"""
-        conn = self._get_connection()
+        conn = self._get_connection(readonly=True)
         cursor = conn.cursor()
         
-        # Get accuracy for last 3 sessions (groups of 10 questions)
+        # Label the change between the two most recent sessions (groups of 10 questions)
         cursor.execute('''
             WITH numbered_questions AS (
                 SELECT 
@@ -611,38 +670,35 @@ class AdaptiveLearningEngine:
                 WHERE session_id = ?
                 ORDER BY timestamp DESC
                 LIMIT 30
+            ),
+            session_groups AS (
+                SELECT 
+                    (row_num - 1) / 10 as session_group,
+                    AVG(correct) as accuracy
+                FROM numbered_questions
+                GROUP BY (row_num - 1) / 10
+            ),
+            recent_change AS (
+                SELECT accuracy - LEAD(accuracy) OVER (ORDER BY session_group DESC) as change
+                FROM session_groups
+                ORDER BY session_group DESC
+                LIMIT 1
             )
             SELECT 
-                (row_num - 1) / 10 as session_group,
-                AVG(correct) as accuracy
-            FROM numbered_questions
-            GROUP BY (row_num - 1) / 10
-            ORDER BY session_group DESC
-            LIMIT 3
+                CASE 
+                    WHEN change IS NULL THEN 'insufficient_data'
+                    WHEN change > 0.1 THEN 'accelerating'
+                    WHEN change > 0.05 THEN 'improving'
+                    WHEN change > -0.05 THEN 'steady'
+                    WHEN change > -0.1 THEN 'declining'
+                    ELSE 'struggling'
+                END as momentum
+            FROM recent_change
         ''', (session_id,))
         
-        session_accuracies = [row[1] for row in cursor.fetchall()]
-        conn.close()
-        
-        if len(session_accuracies) < 2:
-            return "insufficient_data"
-        
-        # Compare most recent to previous
-        if len(session_accuracies) >= 2:
-            recent_change = session_accuracies[0] - session_accuracies[1]
-            
-            if recent_change > 0.1:
-                return "accelerating"
-            elif recent_change > 0.05:
-                return "improving"
-            elif recent_change > -0.05:
-                return "steady"
-            elif recent_change > -0.1:
-                return "declining"
-            else:
-                return "struggling"
+        row = cursor.fetchone()
         
-        return "steady"
+        return row["momentum"] if row else "insufficient_data"
     
     def _check_achievements(self, session_id: str, streak: int, mastery_dist: Dict) -> List[Dict]:
         """Check for achievement badges"""
@@ -668,11 +724,10 @@ class AdaptiveLearningEngine:
             badges.append({"name": "Rising Star", "description": "Mastered 10+ concepts!", "type": "mastery"})
         
         # Get total questions answered
-        conn = self._get_connection()
+        conn = self._get_connection(readonly=True)
         cursor = conn.cursor()
         cursor.execute('SELECT COUNT(*) FROM quiz_performance WHERE session_id = ?', (session_id,))
         total_questions = cursor.fetchone()[0]
-        conn.close()
         
         # Volume achievements
         if total_questions >= 1000:
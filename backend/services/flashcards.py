@@ -1,12 +1,24 @@
 import re
-from typing import List, Dict, Set, Tuple
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from typing import List, Dict, Iterator, Optional, Set, Tuple
 from utils.text import sentences, normalize_space
 import spacy
 
 try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    nlp = None
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+@lru_cache(maxsize=1)
+def _get_nlp():
+    """Load the spaCy pipeline on first use; None if the model isn't installed"""
+    # noun_chunks needs tagger, attribute_ruler (for POS) and parser; ents needs ner
+    try:
+        return spacy.load("en_core_web_sm", exclude=["lemmatizer"])
+    except OSError:
+        return None
 
 _DEF_PATTERNS = [
     r"^\s*([A-Z][A-Za-z0-9\- ]{1,60})\s+is\s+(.*)$",
@@ -25,24 +37,53 @@ _DEF_PATTERNS = [
     r"^\s*In\s+[\w\s]+,\s+([A-Z][A-Za-z0-9\- ]{1,60})\s+is\s+(.*)$",
 ]
 
+# All patterns as one alternation; branch k captures (term, definition) in groups 2k+1, 2k+2
+_DEF_RE = re.compile("|".join(f"(?:{p})" for p in _DEF_PATTERNS), re.IGNORECASE)
+_DEF_RES = [re.compile(p, re.IGNORECASE) for p in _DEF_PATTERNS]
+_ARE_RE = re.compile(r"\b(are)\b", re.IGNORECASE)
+
+_ACADEMIC_RE = re.compile(r"process|method|theory|principle|concept|phenomenon")
+_SENT_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_TERM_STRIP_TRAIL = re.compile(r"[.:,;]+$")
+_ARTICLE_PREFIX = re.compile(r"^(the|a|an)\s+", re.IGNORECASE)
+# Tried in order; the first match's group 1 is the definition's first clause
+_DEFN_BOUNDARIES = (
+    re.compile(r"(.+?[.!?])(\s|$)"),
+    re.compile(r"(.+?;)(\s|$)"),
+    re.compile(r"(.+?)(?:\s+(?:However|But|Although|While))"),
+)
+
+def _build_hs_database():
+    """Compile the definition patterns into a Hyperscan block-mode database"""
+    flags = (hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_MULTILINE
+             | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP)
+    db = hyperscan.Database()
+    db.compile(
+        expressions=[p.encode() for p in _DEF_PATTERNS],
+        ids=list(range(len(_DEF_PATTERNS))),
+        elements=len(_DEF_PATTERNS),
+        flags=[flags] * len(_DEF_PATTERNS),
+    )
+    return db
+
+try:
+    _HS_DB = _build_hs_database() if hyperscan else None
+except hyperscan.error:
+    _HS_DB = None
+
 def _clean_term(term: str) -> str:
     """Enhanced term cleaning with better edge case handling"""
     term = normalize_space(term)
-    term = re.sub(r"[.:,;]+$", "", term)
-    term = re.sub(r"^(the|a|an)\s+", "", term, flags=re.IGNORECASE)
+    term = _TERM_STRIP_TRAIL.sub("", term)
+    term = _ARTICLE_PREFIX.sub("", term)
     return term.strip()
 
 def _clean_defn(defn: str) -> str:
     """Enhanced definition cleaning with context preservation"""
     defn = normalize_space(defn)
-    patterns = [
-        r"(.+?[.!?])(\s|$)",
-        r"(.+?;)(\s|$)",
-        r"(.+?)(?:\s+(?:However|But|Although|While))",
-    ]
-    
-    for pattern in patterns:
-        m = re.match(pattern, defn)
+    
+    for pattern in _DEFN_BOUNDARIES:
+        m = pattern.match(defn)
         if m:
             return m.group(1).strip()
     
@@ -74,21 +115,70 @@ def _calculate_quality_score(term: str, answer: str, context: str = "") -> float
     elif answer_length > 40:
         score -= 0.1
     
+    term_lower = term.lower()
+    answer_lower = answer.lower()
+    
     # Check for academic/technical indicators
-    academic_indicators = ['process', 'method', 'theory', 'principle', 'concept', 'phenomenon']
-    if any(indicator in term.lower() or indicator in answer.lower() for indicator in academic_indicators):
+    if _ACADEMIC_RE.search(term_lower) or _ACADEMIC_RE.search(answer_lower):
         score += 0.15
     
     # Penalize if term appears multiple times in answer (circular definition)
-    if term.lower() in answer.lower():
+    if term_lower in answer_lower:
         score -= 0.2
     
     return max(0.1, score)
 
+def _iter_definition_matches(s: str) -> Iterator[Tuple[str, str]]:
+    """Yield (term, definition) for each matching pattern, in pattern order"""
+    m = _DEF_RE.match(s)
+    if not m:
+        return
+    idx = (m.lastindex - 1) // 2
+    yield m.group(2 * idx + 1), m.group(2 * idx + 2)
+    
+    # Only reached when the caller rejects the first match
+    for pat in _DEF_RES[idx + 1:]:
+        m = pat.match(s)
+        if m:
+            yield m.group(1), m.group(2)
+
+def _definition_candidates(lines: List[str]) -> Optional[Set[int]]:
+    """Indices of lines matching any definition pattern, from one Hyperscan pass.
+
+    Hyperscan reports no capture groups, so this is only a prefilter; the
+    ``re`` patterns still extract term and definition from the hits.
+    Returns None when Hyperscan is unavailable.
+    """
+    if _HS_DB is None:
+        return None
+    
+    # Python's IGNORECASE folds some non-ASCII letters (İ, ı, K, ſ) into [A-Za-z] and
+    # Hyperscan's caseless mode doesn't, so only ASCII lines are prefiltered; the rest
+    # always go through the re patterns
+    hits: Set[int] = {i for i, line in enumerate(lines) if not line.isascii()}
+    ascii_idx = [i for i, line in enumerate(lines) if line.isascii()]
+    if not ascii_idx:
+        return hits
+    
+    # The NUL line stops \s and [\w\s] from bridging two sentences
+    sep = b"\n\x00\n"
+    encoded = [lines[i].encode(errors="surrogatepass") for i in ascii_idx]
+    starts = [0, *accumulate(len(b) + len(sep) for b in encoded)]
+    
+    def on_match(pattern_id, start, end, flags, context):
+        # Every pattern ends in $, so a genuine hit ends exactly at its line's end
+        idx = bisect_right(starts, end - 1) - 1
+        if end == starts[idx] + len(encoded[idx]):
+            hits.add(ascii_idx[idx])
+    
+    _HS_DB.scan(sep.join(encoded), match_event_handler=on_match)
+    return hits
+
 def _extract_key_concepts(text: str) -> Set[str]:
     """Extract key concepts using NLP if available, otherwise use simple heuristics"""
     concepts = set()
     
+    nlp = _get_nlp()
     if nlp:
         doc = nlp(text)
         # Extract noun phrases and named entities
@@ -112,18 +202,17 @@ def extract_flashcards(text: str, max_cards: int = 12, quality_threshold: float
     
     # Get key concepts for additional flashcard generation
     # key_concepts = _extract_key_concepts(text)  # TODO: Implement key concepts usage
-    text_sentences = sentences(text)
-    for i, s in enumerate(text_sentences):
-        s_clean = normalize_space(s)
-        context = " ".join(text_sentences[max(0, i-1):i+2])
+    # Normalizing once up front leaves single spaces, so the split yields already-clean sentences
+    clean_sentences = _SENT_SPLIT.split(normalize_space(text))
+    candidates = _definition_candidates(clean_sentences)
+    for i, s_clean in enumerate(clean_sentences):
+        if candidates is not None and i not in candidates:
+            continue
+        context = " ".join(clean_sentences[max(0, i-1):i+2])
         
-        for pat in _DEF_PATTERNS:
-            m = re.match(pat, s_clean, flags=re.IGNORECASE)
-            if not m:
-                continue
-
-            term = _clean_term(m.group(1))
-            ans = _clean_defn(m.group(2))
+        for raw_term, raw_defn in _iter_definition_matches(s_clean):
+            term = _clean_term(raw_term)
+            ans = _clean_defn(raw_defn)
 
             if len(term) < 2 or len(ans) < 5:
                 continue
@@ -139,7 +228,7 @@ def extract_flashcards(text: str, max_cards: int = 12, quality_threshold: float
             if quality_score >= quality_threshold:
                 seen.add(key)
                 
-                q_word = "are" if re.search(r"\b(are)\b", s_clean, re.I) else "is"
+                q_word = "are" if _ARE_RE.search(s_clean) else "is"
                 card = {
                     "term": term,
                     "question": f"What {q_word} {term}?",
@@ -0,0 +1,122 @@
+import threading
+from typing import Tuple
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _keyword_counts(ids: np.ndarray, V: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Unigram counts, first positions, and distinct bigram keys/counts for a token id stream.
+
+    Bigram keys are encoded as ``a * V + b`` (repeated tokens skipped) and
+    returned in order of first occurrence.
+    """
+    n = ids.size
+    uni = np.zeros(V, np.int64)
+    first = np.full(V, -1, np.int64)
+    for i in range(n):
+        t = ids[i]
+        uni[t] += 1
+        if first[t] < 0:
+            first[t] = i
+
+    m = 0
+    keys = np.empty(max(n - 1, 0), np.int64)
+    pos = np.empty(max(n - 1, 0), np.int64)
+    for i in range(n - 1):
+        a = ids[i]
+        b = ids[i + 1]
+        if a != b:
+            keys[m] = a * V + b
+            pos[m] = i
+            m += 1
+
+    # Stable sort keeps positions ascending within a key, so the run head is its first occurrence
+    order = np.argsort(keys[:m], kind="mergesort")
+    uniq = np.empty(m, np.int64)
+    counts = np.zeros(m, np.int64)
+    firsts = np.empty(m, np.int64)
+    u = -1
+    for j in range(m):
+        k = keys[order[j]]
+        if u < 0 or k != uniq[u]:
+            u += 1
+            uniq[u] = k
+            firsts[u] = pos[order[j]]
+        counts[u] += 1
+    u += 1
+
+    by_first = np.argsort(firsts[:u])
+    return uni, first, uniq[:u][by_first], counts[:u][by_first]
+
+
+def _keyword_counts_numpy(ids: np.ndarray, V: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized fallback for :func:`_keyword_counts` when Numba is unavailable"""
+    n = ids.size
+    uni = np.bincount(ids, minlength=V)
+    first = np.full(V, n, dtype=np.int64)
+    np.minimum.at(first, ids, np.arange(n))
+
+    a, b = ids[:-1], ids[1:]
+    keep = a != b
+    keys, first_idx, counts = np.unique(a[keep] * V + b[keep], return_index=True, return_counts=True)
+    by_first = np.argsort(first_idx, kind="stable")
+    return uni, first, keys[by_first], counts[by_first]
+
+
+def _jaccard_matrix(indices: np.ndarray, indptr: np.ndarray, n: int) -> np.ndarray:
+    """Pairwise Jaccard similarity of n id sets stored CSR-style.
+
+    Row i's ids are ``indices[indptr[i]:indptr[i + 1]]`` and must be sorted and unique;
+    the intersection is a linear merge of the two rows.
+    """
+    out = np.zeros((n, n), np.float64)
+    for i in range(n):
+        a0, a1 = indptr[i], indptr[i + 1]
+        for j in range(i, n):
+            b0, b1 = indptr[j], indptr[j + 1]
+            p, q, inter = a0, b0, 0
+            while p < a1 and q < b1:
+                x, y = indices[p], indices[q]
+                if x == y:
+                    inter += 1
+                    p += 1
+                    q += 1
+                elif x < y:
+                    p += 1
+                else:
+                    q += 1
+            union = (a1 - a0) + (b1 - b0) - inter
+            if union > 0:
+                out[i, j] = out[j, i] = inter / union
+    return out
+
+
+def _jaccard_matrix_numpy(indices: np.ndarray, indptr: np.ndarray, n: int) -> np.ndarray:
+    """Vectorized fallback for :func:`_jaccard_matrix` when Numba is unavailable"""
+    m = np.zeros((n, int(indices.max()) + 1 if indices.size else 0))
+    m[np.repeat(np.arange(n), np.diff(indptr)), indices] = 1.0
+    inter = m @ m.T
+    sizes = m.sum(axis=1)
+    union = sizes[:, None] + sizes[None, :] - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, inter / union, 0.0)
+
+
+def _warm_up():
+    keyword_counts(np.zeros(2, np.int64), 1)
+    jaccard_matrix(np.zeros(1, np.int64), np.array([0, 1], np.int64), 1)
+
+
+if njit is not None:
+    keyword_counts = njit(cache=True)(_keyword_counts)
+    jaccard_matrix = njit(cache=True)(_jaccard_matrix)
+    # Compile in the background so the first request doesn't pay for it
+    threading.Thread(target=_warm_up, daemon=True).start()
+else:
+    keyword_counts = _keyword_counts_numpy
+    jaccard_matrix = _jaccard_matrix_numpy
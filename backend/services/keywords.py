@@ -1,21 +1,23 @@
 import re
 from typing import List, Dict, Tuple
-from collections import Counter
+import numpy as np
+from services.kernels import keyword_counts
 from utils.text import normalize_space
 
-_STOP = {
+_STOP = frozenset({
     "a","an","and","the","or","but","if","then","so","of","to","in","on","for","with","at","by","from","as",
     "is","are","was","were","be","been","being","it","that","this","these","those","i","you","he","she","we",
     "they","them","his","her","their","our","your","my","me","can","could","should","would","may","might",
     "will","just","not","no","do","does","did","done","than","into","over","under","about","between","also"
-}
+})
+# Bit k is set when some stopword starts with chr(k); tokens whose first char misses skip the set probe
+_STOP_FIRST_CHAR_MASK = sum(1 << c for c in {ord(w[0]) for w in _STOP})
 
 WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9\-']+")
 
-def _tokens(text: str) -> List[str]:
-    return [t.lower() for t in WORD_RE.findall(text)]
-
 def _is_good(tok: str) -> bool:
+    if not (_STOP_FIRST_CHAR_MASK >> ord(tok[0])) & 1:
+        return len(tok) > 2 and not tok.isnumeric()
     return tok not in _STOP and len(tok) > 2 and not tok.isnumeric()
 
 def extract_keywords(text: str, top_k: int = 10) -> List[Dict[str, float]]:
@@ -23,32 +25,44 @@ def extract_keywords(text: str, top_k: int = 10) -> List[Dict[str, float]]:
     if not text:
         return []
 
-    toks = _tokens(text)
-    good = [t for t in toks if _is_good(t)]
-
-    uni = Counter(good)
-    bi: Counter[Tuple[str,str]] = Counter()
-    for i in range(len(good) - 1):
-        a, b = good[i], good[i+1]
-        if a != b:
-            bi[(a,b)] += 1
+    # One pass: lowercase, filter and id-encode each match straight into the array.
+    # Token ids are assigned in first-occurrence order, so id order == insertion order
+    vocab: Dict[str, int] = {}
+    ids = np.fromiter(
+        (vocab.setdefault(t, len(vocab)) for t in map(str.lower, WORD_RE.findall(text)) if _is_good(t)),
+        dtype=np.int64,
+    )
+    if not ids.size:
+        return []
+    words = list(vocab)
+    n, V = ids.size, len(vocab)
 
-    pos_weight = {}
-    for idx, t in enumerate(good):
-        if t not in pos_weight:
-            pos_weight[t] = 1.0 + 0.2 * (1.0 - idx / max(1, len(good)-1))
+    uni, first_pos, keys, bi_counts = keyword_counts(ids, V)
+    pos_weight = 1.0 + 0.2 * (1.0 - first_pos / max(1, n - 1))
+    uni_scores = (uni / uni.max()) * pos_weight
 
-    scores: Dict[str, float] = {}
-    max_uni = max(uni.values()) if uni else 1
-    for w, c in uni.items():
-        scores[w] = (c / max_uni) * pos_weight.get(w, 1.0)
+    # Bigram keys are a*V + b, already in first-occurrence order for ties
+    bi_a, bi_b = keys // V, keys % V
+    bi_scores = uni_scores[bi_a] * 0.6 + uni_scores[bi_b] * 0.6 + bi_counts * 0.4
 
-    for (a,b), c in bi.items():
-        pair = f"{a} {b}"
-        if uni[a] >= 1 and uni[b] >= 1 and c >= 1:
-            scores[pair] = scores.get(a,0) * 0.6 + scores.get(b,0) * 0.6 + c * 0.4
+    # Unigrams rank ahead of bigrams on ties, as with the old dict insertion order
+    all_scores = np.concatenate((uni_scores, bi_scores))
+    if 0 < top_k < all_scores.size:
+        # Partition to find the k-th best score, then stable-sort only the candidates at or
+        # above it; keeping every tie with the cutoff preserves the full-sort tie order
+        kth = -np.partition(-all_scores, top_k - 1)[top_k - 1]
+        cand = np.flatnonzero(all_scores >= kth)
+    else:
+        cand = np.arange(all_scores.size)
+    top = cand[np.argsort(-all_scores[cand], kind="stable")][:top_k]
 
-    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+    ranked: List[Tuple[str, float]] = []
+    for i in top.tolist():
+        if i < V:
+            ranked.append((words[i], float(all_scores[i])))
+        else:
+            j = i - V
+            ranked.append((f"{words[bi_a[j]]} {words[bi_b[j]]}", float(all_scores[i])))
 
     if ranked:
         m = ranked[0][1]
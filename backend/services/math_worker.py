@@ -0,0 +1,36 @@
+"""Child process for sympy calls that may never finish; visual_qa kills it when one overruns.
+
+Protocol: pickled (op, args) requests on stdin, pickled (ok, result-or-message) replies on stdout.
+"""
+import pickle
+import sys
+
+import sympy as sp
+
+_OPS = {"solve": sp.solve, "integrate": sp.integrate}
+
+
+def main():
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    # Anything else printed to stdout would corrupt the reply stream
+    sys.stdout = sys.stderr
+
+    # Ready once sympy has imported, so the caller's time limit doesn't include startup
+    pickle.dump(None, stdout)
+    stdout.flush()
+    while True:
+        try:
+            op, args = pickle.load(stdin)
+        except EOFError:
+            # Parent closed the pipe or exited
+            return
+        try:
+            reply = (True, _OPS[op](*args))
+        except Exception as e:
+            reply = (False, str(e))
+        pickle.dump(reply, stdout)
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
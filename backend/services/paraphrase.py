@@ -1,36 +1,55 @@
-from transformers import pipeline
-from typing import Optional
+from typing import List, Optional
 import re
 
+import torch
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
 _model_name = "t5-small"
-_pipe: Optional[any] = None
+_tokenizer: Optional[any] = None
+_model: Optional[any] = None
+_HIGH_QUALITY_BEAMS = 4
+_TIDY_PUNCT = re.compile(r"\s+([.,!?;:])")
+_TIDY_WS = re.compile(r"\s+")
 
 def _lazy():
-    global _pipe
-    if _pipe is None:
-        _pipe = pipeline(
-            "text2text-generation",
-            model=_model_name,
-            tokenizer=_model_name,
-            framework="pt",
-            device=-1
+    global _tokenizer, _model
+    if _model is None:
+        _tokenizer = AutoTokenizer.from_pretrained(_model_name)
+        model = AutoModelForSeq2SeqLM.from_pretrained(_model_name).eval()
+        # CPU-only: int8 Linear weights cut memory ~4x and use the VNNI/AVX2 int8 kernels
+        _model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
         )
 
 def _tidy(s: str) -> str:
-    s = re.sub(r"\s+([.,!?;:])", r"\1", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _TIDY_PUNCT.sub(r"\1", s)
+    s = _TIDY_WS.sub(" ", s).strip()
     return s
 
-def paraphrase(text: str, max_len: int = 128, num_beams: int = 4) -> str:
+@torch.inference_mode()
+def paraphrase_batch(texts: List[str], max_len: int = 128, num_beams: int = 1,
+                     quality: str = "fast") -> List[str]:
+    """Paraphrase several texts in one padded generate call; blank inputs map to ''
+
+    Decoding is greedy by default; quality="high" switches to 4-beam search.
+    """
+    if quality == "high" and num_beams == 1:
+        num_beams = _HIGH_QUALITY_BEAMS
     _lazy()
-    text = (text or "").strip()
-    if not text:
-        return ""
-    prompt = f"paraphrase: {text}"
-    out = _pipe(
-        prompt,
+    texts = [(t or "").strip() for t in texts]
+    prompts = [f"paraphrase: {t}" for t in texts if t]
+    if not prompts:
+        return [""] * len(texts)
+    inputs = _tokenizer(prompts, padding=True, return_tensors="pt")
+    out = _model.generate(
+        **inputs,
         max_length=max_len,
         num_beams=num_beams,
-        do_sample=False
-    )[0]["generated_text"]
-    return _tidy(out)
+        do_sample=False,
+        use_cache=True
+    )
+    decoded = iter(_tokenizer.batch_decode(out, skip_special_tokens=True))
+    return [_tidy(next(decoded)) if t else "" for t in texts]
+
+def paraphrase(text: str, max_len: int = 128, num_beams: int = 1, quality: str = "fast") -> str:
+    return paraphrase_batch([text], max_len=max_len, num_beams=num_beams, quality=quality)[0]
@@ -1,22 +1,174 @@
 import sqlite3
+import copy
 import json
+import threading
+import time
 import hashlib
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Dict, List
 import uuid
-import statistics
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Upper bound on how stale a cached summary can be when another process writes to the db
+_SUMMARY_TTL_SECONDS = 30
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+
+def _epoch_us(dt: datetime) -> int:
+    """Integer microseconds since the Unix epoch; naive datetimes are taken as-is, like SQLite does"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH) // _US
+
+# Mastery bucket of a flashcard_performance row; also stored as the generated mastery_level column
+MASTERY_CASE = """
+    CASE 
+        WHEN CAST(correct_answers AS REAL) / MAX(attempts, 1) >= 0.9 THEN 'mastered'
+        WHEN CAST(correct_answers AS REAL) / MAX(attempts, 1) >= 0.7 THEN 'learning'
+        ELSE 'struggling'
+    END
+"""
+
+_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_fp_session_term ON flashcard_performance(session_id, term)",
+    "CREATE INDEX IF NOT EXISTS idx_qp_session_ts ON quiz_performance(session_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_sa_session_type ON study_activities(session_id, activity_type)",
+    # Covers the accuracy/response-time aggregates so they never touch the table
+    "CREATE INDEX IF NOT EXISTS idx_qp_session_stats "
+    "ON quiz_performance(session_id, is_correct, response_time, difficulty_level)",
+    "CREATE INDEX IF NOT EXISTS idx_fcp_mastery ON flashcard_performance(session_id, mastery_level)",
+)
 
 class PerformanceTracker:
     """Tracks and analyzes student performance for adaptive learning"""
     
     def __init__(self, db_path: str = 'study_assistant.db'):
         self.db_path = db_path
+        self._local = threading.local()
+        # Every thread's pooled connection, so close() can reach them all
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        # Bumped on every write through this tracker so cached summaries never go stale locally
+        self._writes = 0
+        self._summary_cached = lru_cache(maxsize=512)(self._build_performance_summary)
+        # Each set once its table exists and the addition is done; until then write paths retry
+        self._epoch_columns = False
+        self._mastery_column = False
+        self._indexes = False
+        self._ensure_schema()
+    
+    def _ensure_schema(self):
+        """Run whichever schema additions are still waiting for their table to be created"""
+        if not self._epoch_columns:
+            self._ensure_epoch_columns()
+        if not self._mastery_column:
+            self._ensure_mastery_column()
+        # After the columns, since idx_fcp_mastery covers mastery_level
+        if not self._indexes:
+            self._ensure_indexes()
+    
+    def _ensure_epoch_columns(self):
+        """Add integer epoch-microsecond copies of the activity timestamps, backfilling old rows"""
+        # Only study_activities gets them: it is the one table with per-row duration math. Quiz
+        # timestamps are only bucketed with DATE(), and user_sessions is written outside this
+        # tracker, so its one duration per summary still parses the ISO strings
+        conn = self._get_connection()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(study_activities)")}
+        if not columns:
+            # Table not created yet; log_activity retries once it exists
+            return
+        self._epoch_columns = True
+        if "started_us" in columns:
+            return
+        with conn:
+            conn.execute("ALTER TABLE study_activities ADD COLUMN started_us INTEGER")
+            conn.execute("ALTER TABLE study_activities ADD COLUMN completed_us INTEGER")
+            conn.execute('''
+                UPDATE study_activities
+                SET started_us = CAST(ROUND((julianday(started_at) - 2440587.5) * 86400000000) AS INTEGER),
+                    completed_us = CAST(ROUND((julianday(completed_at) - 2440587.5) * 86400000000) AS INTEGER)
+            ''')
+    
+    def _ensure_mastery_column(self):
+        """Add the generated mastery_level column that AdaptiveLearningEngine groups by"""
+        conn = self._get_connection()
+        columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(flashcard_performance)")}
+        if not columns:
+            # Table not created yet; the write paths retry once it exists
+            return
+        self._mastery_column = True
+        if "mastery_level" in columns:
+            return
+        try:
+            with conn:
+                # SQLite only allows VIRTUAL generated columns via ALTER TABLE
+                conn.execute(f"""
+                    ALTER TABLE flashcard_performance
+                    ADD COLUMN mastery_level TEXT GENERATED ALWAYS AS ({MASTERY_CASE}) VIRTUAL
+                """)
+        except sqlite3.OperationalError as e:
+            # "duplicate column": another tracker added it first. Otherwise SQLite < 3.31,
+            # which has no generated columns; readers keep using the inline CASE
+            if "duplicate column" not in str(e):
+                print(f"Warning: Could not add mastery_level column: {e}")
+    
+    def _ensure_indexes(self):
+        """Create the session_id lookup indexes for whichever tables already exist"""
+        conn = self._get_connection()
+        missing_table = False
+        with conn:
+            for ddl in _INDEXES:
+                try:
+                    conn.execute(ddl)
+                except sqlite3.OperationalError as e:
+                    if "no such table" in str(e):
+                        # The write paths retry once it exists
+                        missing_table = True
+                    else:
+                        # e.g. no mastery_level column on SQLite < 3.31; won't succeed later either
+                        print(f"Warning: Could not create index: {e}")
+        self._indexes = not missing_table
     
     def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+        """Per-thread connection, opened once and reused; callers must not close it"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._init_connection()
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+    
+    def _init_connection(self):
+        # close() may run on another thread than the one that opened the connection
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-64000")
+        return conn
+    
+    def close(self):
+        """Close every thread's pooled connection"""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        # Threads reopen on next use rather than reuse a closed connection
+        self._local = threading.local()
     
     def _hash_content(self, content: str) -> str:
         """Create hash of content for anonymized tracking"""
+        # Not security-sensitive, so prefer the much faster non-cryptographic hash
+        if xxhash is not None:
+            return xxhash.xxh3_64_hexdigest(content.encode())
         return hashlib.md5(content.encode()).hexdigest()
     
     def log_activity(self, session_id: str, activity_type: str, content: str, 
@@ -25,29 +177,32 @@ class PerformanceTracker:
         """Log a study activity"""
         activity_id = str(uuid.uuid4())
         content_hash = self._hash_content(content)
+        self._ensure_schema()
         
         conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO study_activities 
-            (activity_id, session_id, activity_type, content_hash, started_at, completed_at, performance_data)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (activity_id, session_id, activity_type, content_hash, started_at, completed_at, json.dumps(performance_data)))
         
-        # Update session last activity
-        cursor.execute('''
-            UPDATE user_sessions SET last_activity = ? WHERE session_id = ?
-        ''', (completed_at, session_id))
-        
-        conn.commit()
-        conn.close()
+        # Both statements commit (or roll back) as one transaction
+        with conn:
+            conn.execute('''
+                INSERT INTO study_activities 
+                (activity_id, session_id, activity_type, content_hash, started_at, completed_at, performance_data,
+                 started_us, completed_us)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (activity_id, session_id, activity_type, content_hash, started_at, completed_at, json.dumps(performance_data),
+                  _epoch_us(started_at), _epoch_us(completed_at)))
+            
+            # Update session last activity
+            conn.execute('''
+                UPDATE user_sessions SET last_activity = ? WHERE session_id = ?
+            ''', (completed_at, session_id))
+        self._writes += 1
         
         return activity_id
     
     def update_flashcard_performance(self, session_id: str, term: str, 
                                    is_correct: bool, response_time: float) -> Dict:
         """Update flashcard performance using spaced repetition principles"""
+        self._ensure_schema()
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -61,59 +216,59 @@ class PerformanceTracker:
         existing = cursor.fetchone()
         now = datetime.now()
         
-        if existing:
-            perf_id, attempts, correct_answers, difficulty, retention_score, last_reviewed = existing
-            attempts += 1
-            if is_correct:
-                correct_answers += 1
+        # Commits on success and rolls back on error, so the pooled connection stays clean
+        with conn:
+            if existing:
+                perf_id, attempts, correct_answers, difficulty, retention_score, last_reviewed = existing
+                attempts += 1
+                if is_correct:
+                    correct_answers += 1
             
-            # Calculate new retention score using SM-2 algorithm principles
-            accuracy = correct_answers / attempts
+                # Calculate new retention score using SM-2 algorithm principles
+                accuracy = correct_answers / attempts
             
-            if is_correct:
-                retention_score = min(2.5, retention_score + 0.1)
-                # Adaptive difficulty based on performance
-                if accuracy > 0.9 and attempts >= 3:
-                    difficulty = min(5, difficulty + 1)
-            else:
-                retention_score = max(1.3, retention_score - 0.2)
-                if accuracy < 0.5:
-                    difficulty = max(1, difficulty - 1)
+                if is_correct:
+                    retention_score = min(2.5, retention_score + 0.1)
+                    # Adaptive difficulty based on performance
+                    if accuracy > 0.9 and attempts >= 3:
+                        difficulty = min(5, difficulty + 1)
+                else:
+                    retention_score = max(1.3, retention_score - 0.2)
+                    if accuracy < 0.5:
+                        difficulty = max(1, difficulty - 1)
             
-            # Calculate next review time (spaced repetition)
-            if is_correct:
-                interval_days = max(1, int(retention_score ** difficulty))
-            else:
-                interval_days = 1  # Review again soon if incorrect
+                # Calculate next review time (spaced repetition)
+                if is_correct:
+                    interval_days = max(1, int(retention_score ** difficulty))
+                else:
+                    interval_days = 1  # Review again soon if incorrect
             
-            next_review = now + timedelta(days=interval_days)
+                next_review = now + timedelta(days=interval_days)
             
-            cursor.execute('''
-                UPDATE flashcard_performance 
-                SET attempts = ?, correct_answers = ?, difficulty_level = ?, 
-                    retention_score = ?, last_reviewed = ?, next_review = ?
-                WHERE performance_id = ?
-            ''', (attempts, correct_answers, difficulty, retention_score, now, next_review, perf_id))
+                cursor.execute('''
+                    UPDATE flashcard_performance 
+                    SET attempts = ?, correct_answers = ?, difficulty_level = ?, 
+                        retention_score = ?, last_reviewed = ?, next_review = ?
+                    WHERE performance_id = ?
+                ''', (attempts, correct_answers, difficulty, retention_score, now, next_review, perf_id))
             
-        else:
-            # New flashcard
-            perf_id = str(uuid.uuid4())
-            attempts = 1
-            correct_answers = 1 if is_correct else 0
-            difficulty = 2  # Start with medium difficulty
-            retention_score = 2.5 if is_correct else 1.8
+            else:
+                # New flashcard
+                perf_id = str(uuid.uuid4())
+                attempts = 1
+                correct_answers = 1 if is_correct else 0
+                difficulty = 2  # Start with medium difficulty
+                retention_score = 2.5 if is_correct else 1.8
             
-            next_review = now + timedelta(days=1 if is_correct else 1)
+                next_review = now + timedelta(days=1 if is_correct else 1)
             
-            cursor.execute('''
-                INSERT INTO flashcard_performance 
-                (performance_id, session_id, term, difficulty_level, attempts, correct_answers, 
-                 last_reviewed, next_review, retention_score)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (perf_id, session_id, term, difficulty, attempts, correct_answers, now, next_review, retention_score))
-        
-        conn.commit()
-        conn.close()
+                cursor.execute('''
+                    INSERT INTO flashcard_performance 
+                    (performance_id, session_id, term, difficulty_level, attempts, correct_answers, 
+                     last_reviewed, next_review, retention_score)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (perf_id, session_id, term, difficulty, attempts, correct_answers, now, next_review, retention_score))
+        self._writes += 1
         
         return {
             "term": term,
@@ -127,9 +282,7 @@ class PerformanceTracker:
     
     def process_quiz_results(self, session_id: str, answers: List[Dict]) -> Dict:
         """Process quiz results and update performance tracking"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
+        self._ensure_schema()
         results = {
             "total_questions": len(answers),
             "correct_answers": 0,
@@ -137,6 +290,8 @@ class PerformanceTracker:
             "question_results": []
         }
         
+        now = datetime.now()
+        rows = []
         for answer in answers:
             question_text = answer.get("question_text", "")
             correct_answer = answer.get("correct_answer", "")
@@ -150,15 +305,8 @@ class PerformanceTracker:
             
             results["total_time"] += response_time
             
-            # Log quiz performance
-            performance_id = str(uuid.uuid4())
-            cursor.execute('''
-                INSERT INTO quiz_performance 
-                (performance_id, session_id, question_text, correct_answer, user_answer, 
-                 is_correct, response_time, difficulty_level, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (performance_id, session_id, question_text, correct_answer, user_answer,
-                  is_correct, response_time, difficulty_level, datetime.now()))
+            rows.append((str(uuid.uuid4()), session_id, question_text, correct_answer, user_answer,
+                         is_correct, response_time, difficulty_level, now))
             
             results["question_results"].append({
                 "question": question_text,
@@ -167,8 +315,16 @@ class PerformanceTracker:
                 "difficulty": difficulty_level
             })
         
-        conn.commit()
-        conn.close()
+        # Log quiz performance in a single prepared-statement batch
+        conn = self._get_connection()
+        with conn:
+            conn.executemany('''
+                INSERT INTO quiz_performance 
+                (performance_id, session_id, question_text, correct_answer, user_answer, 
+                 is_correct, response_time, difficulty_level, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+        self._writes += 1
         
         # Calculate performance metrics
         results["accuracy"] = results["correct_answers"] / max(results["total_questions"], 1)
@@ -189,11 +345,21 @@ class PerformanceTracker:
             return {"error": "Session not found"}
         
         created_at, last_activity = session_info
+        # Copied so callers can't mutate the dict held in the cache
+        return copy.deepcopy(self._summary_cached(session_id, created_at, last_activity,
+                                                  self._writes, int(time.monotonic() // _SUMMARY_TTL_SECONDS)))
+    
+    def _build_performance_summary(self, session_id: str, created_at, last_activity,
+                                   _writes: int, _ttl_bucket: int) -> Dict:
+        """Run the summary aggregates; the trailing arguments only key the cache"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
         
         # Get activity summary
         cursor.execute('''
             SELECT activity_type, COUNT(*) as count, 
-                   AVG((julianday(completed_at) - julianday(started_at)) * 86400) as avg_duration
+                   AVG(COALESCE(completed_us - started_us,
+                                (julianday(completed_at) - julianday(started_at)) * 86400000000)) / 1e6 as avg_duration
             FROM study_activities 
             WHERE session_id = ? 
             GROUP BY activity_type
@@ -228,8 +394,6 @@ class PerformanceTracker:
         
         quiz_stats = cursor.fetchone()
         
-        conn.close()
-        
         return {
             "session_info": {
                 "created_at": created_at,
@@ -254,102 +418,108 @@ class PerformanceTracker:
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        # Get learning progress over time (daily)
+        # Get learning progress over time (daily); learning velocity (mean of the last
+        # three days minus mean of the first three) rides along as a window aggregate
         cursor.execute('''
-            SELECT DATE(timestamp) as day, 
-                   AVG(CASE WHEN is_correct THEN 1.0 ELSE 0.0 END) as daily_accuracy,
-                   COUNT(*) as questions_answered
-            FROM quiz_performance 
-            WHERE session_id = ? 
-            GROUP BY DATE(timestamp)
+            WITH daily AS (
+                SELECT DATE(timestamp) as day, 
+                       AVG(CASE WHEN is_correct THEN 1.0 ELSE 0.0 END) as daily_accuracy,
+                       COUNT(*) as questions_answered
+                FROM quiz_performance 
+                WHERE session_id = ? 
+                GROUP BY DATE(timestamp)
+            ), ranked AS (
+                SELECT day, daily_accuracy, questions_answered,
+                       ROW_NUMBER() OVER (ORDER BY day) as rn_asc,
+                       ROW_NUMBER() OVER (ORDER BY day DESC) as rn_desc,
+                       COUNT(*) OVER () as n_days
+                FROM daily
+            )
+            SELECT day, daily_accuracy, questions_answered,
+                   CASE WHEN n_days >= 2 THEN
+                       AVG(CASE WHEN rn_desc <= 3 THEN ROUND(daily_accuracy, 3) END) OVER ()
+                       - AVG(CASE WHEN rn_asc <= 3 THEN ROUND(daily_accuracy, 3) END) OVER ()
+                   ELSE 0 END as velocity
+            FROM ranked
             ORDER BY day
         ''', (session_id,))
         
+        daily_rows = cursor.fetchall()
         daily_progress = [
             {"date": row[0], "accuracy": round(row[1], 3), "questions": row[2]}
-            for row in cursor.fetchall()
+            for row in daily_rows
         ]
+        learning_velocity = daily_rows[0][3] if daily_rows else 0
         
-        # Get difficulty progression
+        # Difficulty breakdown, weak areas and strong areas in one round-trip; the first
+        # column tags which result set each row belongs to
         cursor.execute('''
-            SELECT difficulty_level, 
-                   AVG(CASE WHEN is_correct THEN 1.0 ELSE 0.0 END) as accuracy,
-                   COUNT(*) as count,
-                   AVG(response_time) as avg_time
-            FROM quiz_performance 
-            WHERE session_id = ? 
-            GROUP BY difficulty_level
-            ORDER BY difficulty_level
-        ''', (session_id,))
-        
-        difficulty_analysis = [
-            {
-                "difficulty": row[0],
-                "accuracy": round(row[1], 3),
-                "questions_count": row[2],
-                "avg_response_time": round(row[3], 2)
-            }
-            for row in cursor.fetchall()
-        ]
-        
-        # Get weak areas (topics with low performance)
-        cursor.execute('''
-            SELECT fp.term, 
-                   CAST(fp.correct_answers AS FLOAT) / fp.attempts as accuracy,
-                   fp.attempts,
-                   fp.difficulty_level,
-                   fp.retention_score
-            FROM flashcard_performance fp
-            WHERE fp.session_id = ? 
-            AND CAST(fp.correct_answers AS FLOAT) / fp.attempts < 0.7
-            ORDER BY accuracy ASC
-            LIMIT 10
-        ''', (session_id,))
-        
-        weak_areas = [
-            {
-                "term": row[0],
-                "accuracy": round(row[1], 3),
-                "attempts": row[2],
-                "difficulty": row[3],
-                "retention_score": round(row[4], 2)
-            }
-            for row in cursor.fetchall()
-        ]
-        
-        # Get strong areas
-        cursor.execute('''
-            SELECT fp.term, 
-                   CAST(fp.correct_answers AS FLOAT) / fp.attempts as accuracy,
-                   fp.attempts,
-                   fp.retention_score
-            FROM flashcard_performance fp
-            WHERE fp.session_id = ? 
-            AND CAST(fp.correct_answers AS FLOAT) / fp.attempts >= 0.9
-            AND fp.attempts >= 3
-            ORDER BY accuracy DESC, retention_score DESC
-            LIMIT 10
-        ''', (session_id,))
-        
-        strong_areas = [
-            {
-                "term": row[0],
-                "accuracy": round(row[1], 3),
-                "attempts": row[2],
-                "retention_score": round(row[3], 2)
-            }
-            for row in cursor.fetchall()
-        ]
-        
-        # Calculate learning velocity (improvement over time)
-        if len(daily_progress) >= 2:
-            recent_accuracy = statistics.mean([day["accuracy"] for day in daily_progress[-3:]])
-            early_accuracy = statistics.mean([day["accuracy"] for day in daily_progress[:3]])
-            learning_velocity = recent_accuracy - early_accuracy
-        else:
-            learning_velocity = 0
-        
-        conn.close()
+            SELECT * FROM (
+                SELECT 'difficulty' as kind, difficulty_level, 
+                       AVG(CASE WHEN is_correct THEN 1.0 ELSE 0.0 END) as accuracy,
+                       COUNT(*) as count,
+                       NULL,
+                       AVG(response_time) as avg_time
+                FROM quiz_performance 
+                WHERE session_id = ? 
+                GROUP BY difficulty_level
+                ORDER BY difficulty_level
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'weak', fp.term, 
+                       CAST(fp.correct_answers AS FLOAT) / fp.attempts as accuracy,
+                       fp.attempts,
+                       fp.difficulty_level,
+                       fp.retention_score
+                FROM flashcard_performance fp
+                WHERE fp.session_id = ? 
+                AND CAST(fp.correct_answers AS FLOAT) / fp.attempts < 0.7
+                ORDER BY accuracy ASC
+                LIMIT 10
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'strong', fp.term, 
+                       CAST(fp.correct_answers AS FLOAT) / fp.attempts as accuracy,
+                       fp.attempts,
+                       NULL,
+                       fp.retention_score
+                FROM flashcard_performance fp
+                WHERE fp.session_id = ? 
+                AND CAST(fp.correct_answers AS FLOAT) / fp.attempts >= 0.9
+                AND fp.attempts >= 3
+                ORDER BY accuracy DESC, retention_score DESC
+                LIMIT 10
+            )
+        ''', (session_id, session_id, session_id))
+        
+        difficulty_analysis = []
+        weak_areas = []
+        strong_areas = []
+        for kind, key, accuracy, count, difficulty, extra in cursor.fetchall():
+            if kind == 'difficulty':
+                difficulty_analysis.append({
+                    "difficulty": key,
+                    "accuracy": round(accuracy, 3),
+                    "questions_count": count,
+                    "avg_response_time": round(extra, 2)
+                })
+            elif kind == 'weak':
+                weak_areas.append({
+                    "term": key,
+                    "accuracy": round(accuracy, 3),
+                    "attempts": count,
+                    "difficulty": difficulty,
+                    "retention_score": round(extra, 2)
+                })
+            else:
+                strong_areas.append({
+                    "term": key,
+                    "accuracy": round(accuracy, 3),
+                    "attempts": count,
+                    "retention_score": round(extra, 2)
+                })
         
         return {
             "daily_progress": daily_progress,
@@ -1,13 +1,87 @@
-import random
-from typing import List, Dict, Set
+import re
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from itertools import accumulate
+from typing import Iterable, Iterator, List, Dict, Optional, Sequence, Set, Tuple
+import numpy as np
 from services.flashcards import extract_flashcards
+from services.kernels import jaccard_matrix
 from utils.text import sentences
 import hashlib
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+def _question_id(key: str) -> str:
+    """Short non-cryptographic id for a question"""
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(key.encode())[:8]
+    return hashlib.md5(key.encode()).hexdigest()[:8]
+
+def _jaccard_matrix(word_lists: List[Iterable[str]]) -> np.ndarray:
+    """Pairwise Jaccard similarity between the word sets of each entry"""
+    vocab: Dict[str, int] = {}
+    rows = [sorted({vocab.setdefault(w, len(vocab)) for w in words}) for words in word_lists]
+    indptr = np.fromiter(accumulate((len(r) for r in rows), initial=0), dtype=np.int64, count=len(rows) + 1)
+    indices = np.fromiter((i for r in rows for i in r), dtype=np.int64, count=int(indptr[-1]))
+    return jaccard_matrix(indices, indptr, len(rows))
+
+@dataclass(slots=True)
+class _Card:
+    """A flashcard plus the values quiz building derives from it, read by attribute in the hot loops"""
+    term: str
+    answer: str
+    quality_score: float = 0.5
+    term_lc: str = ""
+    answer_words: List[str] = field(default_factory=list)
+    answer_wset: Set[str] = field(default_factory=set)
+    template_draw: float = 0.0
+    shuffle_keys: Optional[np.ndarray] = None
+    distractor_idx: Sequence[int] = ()
+    filler_idx: Sequence[int] = ()
+    
+    @classmethod
+    def from_flashcard(cls, card: Dict) -> "_Card":
+        answer_words = card["answer"].lower().split()
+        return cls(card["term"], card["answer"], card.get("quality_score", 0.5),
+                   card["term"].lower(), answer_words, set(answer_words))
+
+class _SentenceIndex:
+    """A document's sentences, with their lowercased forms joined for single-scan term lookup"""
+    
+    def __init__(self, text: str):
+        self.sentences = sentences(text)
+        self.lowered = [s.lower() for s in self.sentences]
+        # NUL never occurs in a term, so a match can't straddle two sentences
+        self._joined = "\x00".join(self.lowered)
+        self._starts = list(accumulate((len(s) + 1 for s in self.lowered[:-1]), initial=0))
+    
+    def containing(self, term_lower: str) -> Iterator[Tuple[str, str]]:
+        """Yield (sentence, lowered) for each sentence whose lowered text contains term_lower, in order"""
+        if not term_lower:
+            yield from zip(self.sentences, self.lowered)
+            return
+        find = self._joined.find
+        pos = find(term_lower)
+        while pos >= 0:
+            i = bisect_right(self._starts, pos) - 1
+            yield self.sentences[i], self.lowered[i]
+            if i + 1 >= len(self._starts):
+                return
+            pos = find(term_lower, self._starts[i + 1])
+
 class EnhancedQuizService:
     """Enhanced quiz generation with adaptive difficulty and improved question types"""
     
-    def __init__(self):
+    def __init__(self, seed: Optional[int] = None):
+        # Seeds one generator per build_quiz call; Generators aren't thread-safe, so concurrent
+        # quizzes must not share one
+        self._seeds = np.random.default_rng(seed)
+        self._seeds_lock = threading.Lock()
+        self._local = threading.local()
         self.question_templates = {
             "definition": [
                 "What is {term}?",
@@ -42,11 +116,27 @@ class EnhancedQuizService:
             4: {"name": "Hard", "distractors": "subtle", "complexity": "complex"},
             5: {"name": "Expert", "distractors": "very_subtle", "complexity": "very_complex"}
         }
+        
+        # Plain substring alternations (no word boundaries), matching the old `in` checks
+        self._app_re = re.compile(
+            "used|applied|implemented|utilized|employed|helps|enables|allows|provides|supports"
+        )
+        self._ce_re = re.compile(
+            "causes|results in|leads to|produces|creates|due to|because of|results from|caused by"
+        )
+    
+    @property
+    def _rng(self) -> np.random.Generator:
+        """The calling thread's generator for the quiz it is building; draws are made in bulk"""
+        return self._local.rng
     
     def build_quiz(self, text: str, max_qs: int = 5, difficulty_level: int = 3, 
                    question_types: List[str] = None) -> List[Dict]:
         """Enhanced quiz building with multiple question types and adaptive difficulty"""
         
+        with self._seeds_lock:
+            self._local.rng = np.random.default_rng(self._seeds.integers(2**63))
+        
         # Extract flashcards as base material
         cards = extract_flashcards(text, max_cards=max_qs * 3)  # Get more cards for variety
         if not cards:
@@ -56,24 +146,42 @@ class EnhancedQuizService:
         if question_types is None:
             question_types = ["definition", "application", "comparison"]
         
+        # Lowercase and split each card once; the attribute-access cards stay internal to quiz building
+        cards = [_Card.from_flashcard(c) for c in cards]
+        
+        # Pre-draw every card's template pick and choice-shuffle keys in two batched calls
+        template_draws = self._rng.random(len(cards))
+        shuffle_keys = self._rng.random((len(cards), 4))
+        for c, draw, keys in zip(cards, template_draws, shuffle_keys):
+            c.template_draw = float(draw)
+            c.shuffle_keys = keys
+        # An empty question_types only fails (IndexError) once a type is needed, as before
+        type_draws = self._rng.integers(0, len(question_types), size=max_qs) if question_types else ()
+        
         quiz_questions = []
         used_terms = set()
+        # Answer-to-answer similarity for every card pair, shared by all distractor lookups
+        similarity = _jaccard_matrix([c.answer_wset for c in cards])
+        # Distractors for every card in one pooled pass rather than one pool rebuild per question
+        self._assign_distractors(cards, similarity, difficulty_level)
+        # Split (and lowercase) the document once instead of once per question
+        sentence_index = _SentenceIndex(text)
         
         # Generate different types of questions
         for i, card in enumerate(cards[:max_qs]):
-            if card["term"].lower() in used_terms:
+            if card.term_lc in used_terms:
                 continue
             
-            used_terms.add(card["term"].lower())
+            used_terms.add(card.term_lc)
             
             # Choose question type based on position and difficulty
             if i == 0:  # First question is always definition
                 q_type = "definition"
             else:
-                q_type = random.choice(question_types)
+                q_type = question_types[type_draws[i]]
             
             question = self._generate_question_by_type(
-                card, q_type, difficulty_level, cards, text
+                card, q_type, difficulty_level, cards, sentence_index, similarity
             )
             
             if question:
@@ -82,63 +190,66 @@ class EnhancedQuizService:
         # Add variety questions if we have room
         if len(quiz_questions) < max_qs:
             variety_questions = self._generate_variety_questions(
-                text, max_qs - len(quiz_questions), difficulty_level, used_terms
+                cards, max_qs, max_qs - len(quiz_questions), difficulty_level, used_terms
             )
             quiz_questions.extend(variety_questions)
         
         return quiz_questions[:max_qs]
     
-    def _generate_question_by_type(self, card: Dict, question_type: str, 
-                                   difficulty_level: int, all_cards: List[Dict], 
-                                   full_text: str) -> Dict:
+    def _generate_question_by_type(self, card: _Card, question_type: str, 
+                                   difficulty_level: int, all_cards: List[_Card], 
+                                   sentence_index: _SentenceIndex,
+                                   similarity: Optional[np.ndarray] = None) -> Dict:
         """Generate a question of specific type"""
         
-        # term = card["term"]  # TODO: Use term for question generation
-        # correct_answer = card["answer"]  # TODO: Use correct_answer for validation
+        # term = card.term  # TODO: Use term for question generation
+        # correct_answer = card.answer  # TODO: Use correct_answer for validation
         
         if question_type == "definition":
             return self._create_definition_question(card, difficulty_level, all_cards)
         
         elif question_type == "application":
-            return self._create_application_question(card, difficulty_level, full_text, all_cards)
+            return self._create_application_question(card, difficulty_level, sentence_index, all_cards, similarity)
         
         elif question_type == "comparison":
-            return self._create_comparison_question(card, difficulty_level, all_cards)
+            return self._create_comparison_question(card, difficulty_level, all_cards, similarity)
         
         elif question_type == "cause_effect":
-            return self._create_cause_effect_question(card, difficulty_level, full_text)
+            return self._create_cause_effect_question(card, difficulty_level, sentence_index)
         
         else:
             # Default to definition
             return self._create_definition_question(card, difficulty_level, all_cards)
     
-    def _create_definition_question(self, card: Dict, difficulty_level: int, 
-                                    all_cards: List[Dict]) -> Dict:
+    def _create_definition_question(self, card: _Card, difficulty_level: int, 
+                                    all_cards: List[_Card]) -> Dict:
         """Create a definition-style question"""
-        term = card["term"]
-        correct_answer = card["answer"]
+        term = card.term
+        correct_answer = card.answer
         
         # Choose question template
-        template = random.choice(self.question_templates["definition"])
+        template = self._pick_template("definition", card)
         question_text = template.format(term=term)
         
         # Generate distractors
-        distractors = self._generate_smart_distractors(
-            correct_answer, all_cards, difficulty_level, "definition"
-        )
+        # Candidates were picked for this card against all_cards; none when there's no pool
+        picks = (card.distractor_idx, card.filler_idx) if all_cards else ((), ())
+        distractors = self._generate_smart_distractors(correct_answer, all_cards, *picks)
         
         return self._build_question_dict(
             question_text, correct_answer, distractors, difficulty_level, 
-            "definition", term, card.get("quality_score", 0.5)
+            "definition", term, card.quality_score,
+            card.shuffle_keys
         )
     
-    def _create_application_question(self, card: Dict, difficulty_level: int, 
-                                     full_text: str, all_cards: List[Dict]) -> Dict:
+    def _create_application_question(self, card: _Card, difficulty_level: int, 
+                                     sentence_index: _SentenceIndex, all_cards: List[_Card],
+                                     similarity: Optional[np.ndarray] = None) -> Dict:
         """Create an application-style question"""
-        term = card["term"]
+        term = card.term
         
         # Extract context about when/how the term is used
-        context_sentences = self._find_context_sentences(term, full_text)
+        context_sentences = self._find_context_sentences(term, sentence_index)
         
         if not context_sentences:
             # Fall back to definition question
@@ -147,7 +258,7 @@ class EnhancedQuizService:
         # Create application-focused answer
         application_context = self._extract_application_context(context_sentences, term)
         
-        template = random.choice(self.question_templates["application"])
+        template = self._pick_template("application", card)
         question_text = template.format(term=term)
         
         # Generate application-specific distractors
@@ -157,24 +268,26 @@ class EnhancedQuizService:
         
         return self._build_question_dict(
             question_text, application_context, distractors, difficulty_level,
-            "application", term, card.get("quality_score", 0.5)
+            "application", term, card.quality_score,
+            card.shuffle_keys
         )
     
-    def _create_comparison_question(self, card: Dict, difficulty_level: int, 
-                                    all_cards: List[Dict]) -> Dict:
+    def _create_comparison_question(self, card: _Card, difficulty_level: int, 
+                                    all_cards: List[_Card],
+                                    similarity: Optional[np.ndarray] = None) -> Dict:
         """Create a comparison-style question"""
-        term = card["term"]
-        correct_answer = card["answer"]
+        term = card.term
+        correct_answer = card.answer
         
         # Find similar terms for comparison
-        similar_terms = self._find_similar_terms(card, all_cards)
+        similar_terms = self._find_similar_terms(card, all_cards, similarity)
         
         if not similar_terms:
             # Fall back to definition question
             return self._create_definition_question(card, difficulty_level, all_cards)
         
         # Create comparison-focused question and answer
-        template = random.choice(self.question_templates["comparison"])
+        template = self._pick_template("comparison", card)
         question_text = template.format(term=term)
         
         # Modify answer to focus on distinguishing features
@@ -187,22 +300,23 @@ class EnhancedQuizService:
         
         return self._build_question_dict(
             question_text, comparison_answer, distractors, difficulty_level,
-            "comparison", term, card.get("quality_score", 0.5)
+            "comparison", term, card.quality_score,
+            card.shuffle_keys
         )
     
-    def _create_cause_effect_question(self, card: Dict, difficulty_level: int, 
-                                      full_text: str) -> Dict:
+    def _create_cause_effect_question(self, card: _Card, difficulty_level: int, 
+                                      sentence_index: _SentenceIndex) -> Dict:
         """Create a cause-and-effect style question"""
-        term = card["term"]
+        term = card.term
         
         # Look for cause-effect relationships in the text
-        cause_effect_context = self._find_cause_effect_context(term, full_text)
+        cause_effect_context = self._find_cause_effect_context(term, sentence_index)
         
         if not cause_effect_context:
             # Fall back to definition question
             return self._create_definition_question(card, difficulty_level, [])
         
-        template = random.choice(self.question_templates["cause_effect"])
+        template = self._pick_template("cause_effect", card)
         question_text = template.format(term=term)
         
         # Generate cause-effect distractors
@@ -212,31 +326,26 @@ class EnhancedQuizService:
         
         return self._build_question_dict(
             question_text, cause_effect_context, distractors, difficulty_level,
-            "cause_effect", term, card.get("quality_score", 0.5)
+            "cause_effect", term, card.quality_score,
+            card.shuffle_keys
         )
     
-    def _generate_smart_distractors(self, correct_answer: str, all_cards: List[Dict], 
-                                    difficulty_level: int, question_type: str) -> List[str]:
-        """Generate intelligent distractors based on difficulty level"""
-        
-        distractors = []
-        answers_pool = [c["answer"] for c in all_cards if c["answer"] != correct_answer]
-        
-        if difficulty_level <= 2:  # Easy - obvious distractors
-            distractors = self._generate_obvious_distractors(correct_answer, answers_pool)
+    def _pick_template(self, question_type: str, card: _Card) -> str:
+        """Template chosen by the card's pre-drawn uniform value"""
+        templates = self.question_templates[question_type]
+        return templates[int(card.template_draw * len(templates))]
+    
+    def _generate_smart_distractors(self, correct_answer: str, all_cards: List[_Card],
+                                    candidates: Sequence[int], fillers: Sequence[int]) -> List[str]:
+        """Turn pre-picked distractor card indices into answers, topping up at random from fillers if short"""
         
-        elif difficulty_level == 3:  # Medium - plausible distractors
-            distractors = self._generate_plausible_distractors(correct_answer, answers_pool)
-        
-        else:  # Hard - subtle distractors
-            distractors = self._generate_subtle_distractors(correct_answer, answers_pool)
+        distractors = [all_cards[j].answer for j in candidates]
         
         # Ensure we have exactly 3 distractors
-        while len(distractors) < 3 and answers_pool:
-            candidate = random.choice(answers_pool)
-            if candidate not in distractors and candidate != correct_answer:
-                distractors.append(candidate)
-                answers_pool.remove(candidate)
+        need = 3 - len(distractors)
+        if need > 0 and len(fillers):
+            picks = self._rng.choice(len(fillers), size=min(need, len(fillers)), replace=False)
+            distractors.extend(all_cards[fillers[j]].answer for j in picks)
         
         # If we still don't have enough, generate generic ones
         while len(distractors) < 3:
@@ -245,71 +354,61 @@ class EnhancedQuizService:
         
         return distractors[:3]
     
-    def _generate_obvious_distractors(self, correct_answer: str, answers_pool: List[str]) -> List[str]:
-        """Generate obviously wrong distractors for easy questions"""
-        distractors = []
-        
-        # Look for answers that are clearly different in key ways
-        for answer in answers_pool:
-            if len(distractors) >= 3:
-                break
-                
-            # Different length categories
-            if len(answer.split()) != len(correct_answer.split()):
-                distractors.append(answer)
-                continue
-            
-            # Different starting words
-            correct_words = correct_answer.lower().split()
-            answer_words = answer.lower().split()
-            
-            if (correct_words and answer_words and 
-                correct_words[0] != answer_words[0]):
-                distractors.append(answer)
+    def _assign_distractors(self, cards: List[_Card], similarity: np.ndarray, difficulty_level: int):
+        """Pick every card's distractor and top-up filler indices in one pass over the matrix"""
+        answer_ids: Dict[str, int] = {}
+        ids = np.array([answer_ids.setdefault(c.answer, len(answer_ids)) for c in cards], dtype=np.int64)
+        # A card's pool is every card with a different answer, in card order
+        other = ids[:, None] != ids[None, :]
         
-        return distractors
+        if difficulty_level <= 2:  # Easy - obvious distractors
+            picked = self._obvious_candidates(cards, other)
+        elif difficulty_level == 3:  # Medium - plausible distractors
+            picked = self._plausible_candidates(similarity, other)
+        else:  # Hard - subtle distractors
+            picked = self._subtle_candidates(similarity, other)
+        
+        # Top-up fillers: the first card of each other answer, minus answers already picked
+        first_of_answer = np.zeros(len(cards), dtype=bool)
+        first_of_answer[np.unique(ids, return_index=True)[1]] = True
+        fillable = other & first_of_answer
+        for c, row, candidates in zip(cards, fillable, picked):
+            c.distractor_idx = candidates
+            c.filler_idx = np.flatnonzero(row & ~np.isin(ids, ids[candidates])) if len(candidates) < 3 else ()
     
-    def _generate_plausible_distractors(self, correct_answer: str, answers_pool: List[str]) -> List[str]:
-        """Generate plausible but incorrect distractors"""
-        distractors = []
-        correct_words = set(correct_answer.lower().split())
-        
-        # Score answers by similarity (we want moderate similarity)
-        answer_scores = []
-        for answer in answers_pool:
-            answer_words = set(answer.lower().split())
-            similarity = len(correct_words.intersection(answer_words)) / len(correct_words.union(answer_words))
-            answer_scores.append((answer, similarity))
-        
-        # Sort by similarity and take middle range (0.1 to 0.4 similarity)
-        answer_scores.sort(key=lambda x: x[1])
-        
-        for answer, similarity in answer_scores:
-            if len(distractors) >= 3:
-                break
-            if 0.1 <= similarity <= 0.4:  # Moderate similarity
-                distractors.append(answer)
-        
-        return distractors
+    def _obvious_candidates(self, cards: List[_Card], other: np.ndarray) -> List[np.ndarray]:
+        """Obviously wrong distractors: a different word count, or the same count but a different first word"""
+        lens = np.array([len(c.answer_words) for c in cards], dtype=np.int64)
+        first_ids: Dict[str, int] = {}
+        firsts = np.array([first_ids.setdefault(c.answer_words[0], len(first_ids)) if c.answer_words else -1
+                           for c in cards], dtype=np.int64)
+        mask = other & ((lens[:, None] != lens[None, :])
+                        | ((lens[:, None] > 0) & (firsts[:, None] != firsts[None, :])))
+        return [np.flatnonzero(row)[:3] for row in mask]
     
-    def _generate_subtle_distractors(self, correct_answer: str, answers_pool: List[str]) -> List[str]:
-        """Generate subtle, hard-to-distinguish distractors"""
-        distractors = []
-        correct_words = set(correct_answer.lower().split())
-        
-        # Look for answers with high similarity but key differences
-        for answer in answers_pool:
-            if len(distractors) >= 3:
-                break
-                
-            answer_words = set(answer.lower().split())
-            similarity = len(correct_words.intersection(answer_words)) / len(correct_words.union(answer_words))
-            
-            # High similarity but not identical
-            if 0.4 <= similarity <= 0.8:
-                distractors.append(answer)
-        
-        return distractors
+    def _plausible_candidates(self, similarity: np.ndarray, other: np.ndarray) -> List[np.ndarray]:
+        """Plausible but incorrect distractors: least similar first within the moderate range (0.1 to 0.4)"""
+        mask = other & (similarity >= 0.1) & (similarity <= 0.4)
+        out = []
+        for row, sims in zip(mask, similarity):
+            candidates = np.flatnonzero(row)
+            # Stable keeps pool order on ties
+            out.append(candidates[np.argsort(sims[candidates], kind="stable")][:3])
+        return out
+    
+    def _subtle_candidates(self, similarity: np.ndarray, other: np.ndarray) -> List[np.ndarray]:
+        """Subtle, hard-to-distinguish distractors: high similarity but not identical, in pool order"""
+        mask = other & (similarity >= 0.4) & (similarity <= 0.8)
+        return [np.flatnonzero(row)[:3] for row in mask]
+    
+    def _pool_similarity(self, correct_answer: str, all_cards: List[_Card], pool_idx: List[int],
+                         similarity: Optional[np.ndarray]) -> np.ndarray:
+        """Jaccard similarity of correct_answer to each pooled answer, in pool order"""
+        row = next((i for i, c in enumerate(all_cards) if c.answer == correct_answer), None)
+        if similarity is None or row is None:
+            answers = [correct_answer] + [all_cards[j].answer for j in pool_idx]
+            return _jaccard_matrix([a.lower().split() for a in answers])[0, 1:]
+        return similarity[row, pool_idx]
     
     def _generate_generic_distractor(self, correct_answer: str, index: int) -> str:
         """Generate a generic distractor when we can't find good ones"""
@@ -326,66 +425,52 @@ class EnhancedQuizService:
         else:
             return f"An alternative explanation for the concept (option {index + 1})"
     
-    def _find_context_sentences(self, term: str, text: str) -> List[str]:
+    def _find_context_sentences(self, term: str, sentence_index: _SentenceIndex) -> List[str]:
         """Find sentences that provide context about how a term is used"""
         context_sentences = []
-        text_sentences = sentences(text)
+        term_lower = term.lower()
         
-        for sentence in text_sentences:
-            if term.lower() in sentence.lower():
-                # Look for application indicators
-                app_indicators = ['used', 'applied', 'implemented', 'utilized', 'employed', 
-                                'helps', 'enables', 'allows', 'provides', 'supports']
-                
-                if any(indicator in sentence.lower() for indicator in app_indicators):
-                    context_sentences.append(sentence)
+        for sentence, sentence_lower in sentence_index.containing(term_lower):
+            # Look for application indicators
+            if self._app_re.search(sentence_lower):
+                context_sentences.append(sentence)
         
         return context_sentences
     
     def _extract_application_context(self, context_sentences: List[str], term: str) -> str:
         """Extract application context from sentences"""
         # Simple extraction - look for phrases after application indicators
+        term_lower = term.lower()
+        used_phrase = f"{term_lower} is used"
+        helps_phrase = f"{term_lower} helps"
         for sentence in context_sentences:
             sentence_lower = sentence.lower()
-            term_lower = term.lower()
             
-            # Find where the term appears and what follows
-            if f"{term_lower} is used" in sentence_lower:
-                parts = sentence_lower.split(f"{term_lower} is used", 1)
-                if len(parts) > 1:
-                    return f"Used {parts[1].strip()[:100]}..."
+            # Find where the term appears and what follows; sentences carry no trailing
+            # whitespace, so lstrip before slicing matches the old strip()
+            _, found, tail = sentence_lower.partition(used_phrase)
+            if found:
+                return f"Used {tail.lstrip()[:100]}..."
             
-            elif f"{term_lower} helps" in sentence_lower:
-                parts = sentence_lower.split(f"{term_lower} helps", 1)
-                if len(parts) > 1:
-                    return f"Helps {parts[1].strip()[:100]}..."
+            _, found, tail = sentence_lower.partition(helps_phrase)
+            if found:
+                return f"Helps {tail.lstrip()[:100]}..."
         
         # Default to first context sentence
         return context_sentences[0][:150] + "..." if context_sentences else ""
     
-    def _find_similar_terms(self, card: Dict, all_cards: List[Dict]) -> List[Dict]:
+    def _find_similar_terms(self, card: _Card, all_cards: List[_Card],
+                            similarity: Optional[np.ndarray] = None) -> List[_Card]:
         """Find terms similar to the given card's term"""
-        target_words = set(card["answer"].lower().split())
-        similar_terms = []
+        others = [j for j, c in enumerate(all_cards) if c.term != card.term]
+        sims = self._pool_similarity(card.answer, all_cards, others, similarity)
         
-        for other_card in all_cards:
-            if other_card["term"] == card["term"]:
-                continue
-                
-            other_words = set(other_card["answer"].lower().split())
-            similarity = len(target_words.intersection(other_words)) / len(target_words.union(other_words))
-            
-            if similarity > 0.2:  # Some similarity but not identical
-                similar_terms.append({
-                    "card": other_card,
-                    "similarity": similarity
-                })
-        
-        # Sort by similarity and return top ones
-        similar_terms.sort(key=lambda x: x["similarity"], reverse=True)
-        return [item["card"] for item in similar_terms[:3]]
+        # Some similarity but not identical; most similar first, stable on ties
+        candidates = np.flatnonzero(sims > 0.2)
+        candidates = candidates[np.argsort(-sims[candidates], kind="stable")]
+        return [all_cards[others[j]] for j in candidates[:3]]
     
-    def _create_comparison_answer(self, original_answer: str, similar_terms: List[Dict]) -> str:
+    def _create_comparison_answer(self, original_answer: str, similar_terms: List[_Card]) -> str:
         """Create an answer that emphasizes distinguishing features"""
         # Extract key distinguishing words
         original_words = set(original_answer.lower().split())
@@ -393,8 +478,7 @@ class EnhancedQuizService:
         # Find words that are unique to this answer
         unique_words = original_words.copy()
         for similar_card in similar_terms:
-            similar_words = set(similar_card["answer"].lower().split())
-            unique_words -= similar_words
+            unique_words -= similar_card.answer_wset
         
         if unique_words:
             # Emphasize unique aspects
@@ -403,7 +487,7 @@ class EnhancedQuizService:
         
         return original_answer
     
-    def _generate_comparison_distractors(self, correct_answer: str, similar_terms: List[Dict], 
+    def _generate_comparison_distractors(self, correct_answer: str, similar_terms: List[_Card], 
                                         difficulty_level: int) -> List[str]:
         """Generate distractors for comparison questions"""
         distractors = []
@@ -415,7 +499,7 @@ class EnhancedQuizService:
                 
             # Modify the similar answer to make it a plausible but wrong comparison
             modified_answer = self._modify_for_comparison_distractor(
-                similar_card["answer"], difficulty_level
+                similar_card.answer, difficulty_level
             )
             distractors.append(modified_answer)
         
@@ -430,19 +514,13 @@ class EnhancedQuizService:
             # Hard: Subtle difference
             return f"{answer[:80]}... (Similar but distinct application)"
     
-    def _find_cause_effect_context(self, term: str, text: str) -> str:
+    def _find_cause_effect_context(self, term: str, sentence_index: _SentenceIndex) -> str:
         """Find cause-effect relationships involving the term"""
-        text_sentences = sentences(text)
-        cause_effect_indicators = [
-            'causes', 'results in', 'leads to', 'produces', 'creates',
-            'due to', 'because of', 'results from', 'caused by'
-        ]
+        term_lower = term.lower()
         
-        for sentence in text_sentences:
-            if term.lower() in sentence.lower():
-                for indicator in cause_effect_indicators:
-                    if indicator in sentence.lower():
-                        return sentence[:200] + "..."
+        for sentence, sentence_lower in sentence_index.containing(term_lower):
+            if self._ce_re.search(sentence_lower):
+                return sentence[:200] + "..."
         
         return ""
     
@@ -458,34 +536,35 @@ class EnhancedQuizService:
         
         return generic_distractors
     
-    def _generate_variety_questions(self, text: str, needed_count: int, 
+    def _generate_variety_questions(self, cards: List[_Card], start: int, needed_count: int, 
                                    difficulty_level: int, used_terms: Set[str]) -> List[Dict]:
-        """Generate additional variety questions from the text"""
+        """Generate additional variety questions from the extracted cards the main pass didn't reach"""
         variety_questions = []
         
-        # Extract additional concepts that weren't used
-        additional_cards = extract_flashcards(text, max_cards=needed_count * 2)
-        
-        for card in additional_cards:
+        # Distractors were assigned over the whole card list, so look them up in it
+        for card in cards[start:]:
             if len(variety_questions) >= needed_count:
                 break
                 
-            if card["term"].lower() not in used_terms:
-                question = self._create_definition_question(card, difficulty_level, additional_cards)
+            if card.term_lc not in used_terms:
+                question = self._create_definition_question(card, difficulty_level, cards)
                 if question:
                     variety_questions.append(question)
-                    used_terms.add(card["term"].lower())
+                    used_terms.add(card.term_lc)
         
         return variety_questions
     
     def _build_question_dict(self, question_text: str, correct_answer: str, 
                             distractors: List[str], difficulty_level: int,
-                            question_type: str, term: str, quality_score: float) -> Dict:
+                            question_type: str, term: str, quality_score: float,
+                            shuffle_keys: Optional[np.ndarray] = None) -> Dict:
         """Build the final question dictionary"""
         
-        # Create choices and shuffle
+        # Create choices and shuffle; sorting uniform keys gives a uniform permutation
         choices = distractors + [correct_answer]
-        random.shuffle(choices)
+        if shuffle_keys is None:
+            shuffle_keys = self._rng.random(len(choices))
+        choices = [choices[j] for j in np.argsort(shuffle_keys[:len(choices)])]
         
         # Calculate estimated time based on difficulty and complexity
         base_time = 30  # seconds
@@ -493,7 +572,7 @@ class EnhancedQuizService:
         estimated_time = int(base_time * time_multiplier.get(difficulty_level, 1.0))
         
         return {
-            "id": hashlib.md5(f"{question_text}{correct_answer}".encode()).hexdigest()[:8],
+            "id": _question_id(f"{question_text}{correct_answer}"),
             "question": question_text,
             "choices": choices,
             "answer": correct_answer,
@@ -1,25 +1,209 @@
+import io
+import multiprocessing
+import os
+import pickle
+import queue
+import select
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from functools import lru_cache
+from types import SimpleNamespace
 import pytesseract
 import re
-from PIL import Image, ImageEnhance, ImageFilter
-from typing import Dict, List, Optional
+from PIL import Image
+from typing import Dict, List, Optional, Set, Tuple
 from transformers import BlipProcessor, BlipForQuestionAnswering
 import torch
 import sympy as sp
+import cv2
+import numpy as np
+
+try:
+    import tesserocr
+    from tesserocr import OEM
+except ImportError:
+    tesserocr = None
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    from torchao.quantization import quantize_, int8_weight_only, int4_weight_only
+except ImportError:
+    quantize_ = None
+
+# torch.compile pays a one-off compile at boot; on by default only where CUDA graphs help
+_USE_TORCH_COMPILE = os.environ.get(
+    "USE_TORCH_COMPILE", "1" if torch.cuda.is_available() else "0"
+) == "1"
+# OCR passes as (page segmentation mode, character whitelist); an empty whitelist allows everything
+_OCR_PASSES = [
+    (6, ""),
+    (8, "0123456789+-*/=()[]{}abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.,√∫∑∂∞≤≥≠±"),
+    (7, ""),
+]
+# Concurrent VQA requests are coalesced for up to this long, into batches of at most _MAX_BATCH
+_BATCH_WINDOW_S = 0.01
+_MAX_BATCH = 8
+# How much OCR text the regexes, matching and scoring look at
+_OCR_TEXT_LIMIT = 2000
+# Images are graded for sharpness with their longest side scaled down to this
+_SHARPNESS_SIDE = 1000
+# Below this sharpness an image is effectively blank (or blurred past reading) and is rejected
+_BLANK_SHARPNESS = 2.0
+# OCR noise can send sympy's solve/integrate into very long searches
+_SOLVE_TIMEOUT_S = 1.0
+# Working directory for the sympy child, so `python -m services.math_worker` resolves
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_LETTER_RE = re.compile(r'[a-zA-Z]')
+_DERIVATIVE_RE = re.compile(r'd([^/]+)/d([a-zA-Z])')
+_INTEGRAL_RE = re.compile(r'∫([^d]+)d([a-zA-Z])')
+_WS_RE = re.compile(r'\s+')
+# Unicode math symbols OCR tends to produce, mapped to their sympy spelling
+_MATH_SYMBOLS = str.maketrans({
+    '×': '*',
+    '÷': '/',
+    '−': '-',
+    '±': '+-',
+    '²': '**2',
+    '³': '**3',
+})
+_OCR_ARTIFACT_RE = re.compile(r'[|\\]{2,}')
+# Processes serving answer_image_question. Each loads its own copy of BLIP (about 1 GB in
+# FP32), so the default is one; each process answers up to _MAX_BATCH requests at a time
+_VQA_WORKERS = int(os.environ.get("VQA_WORKERS", "1"))
+# Upper bound on one answer_image_question call, including a cold worker loading BLIP
+_VQA_REQUEST_TIMEOUT_S = 300.0
+# Weight-only quantization of the VQA model: none (default), int8 or int4
+_QUANT_MODES = ("none", "int8", "int4")
+_QUANT_MODE = os.environ.get("QUANT_MODE", "none").lower()
+if _QUANT_MODE not in _QUANT_MODES:
+    print(f"Warning: Unknown QUANT_MODE {_QUANT_MODE!r} (expected one of {', '.join(_QUANT_MODES)}); not quantizing")
+    _QUANT_MODE = "none"
+
+@lru_cache(maxsize=1024)
+def _parse(expr_str: str, var: Optional[str] = None) -> sp.Expr:
+    """sympify with results cached by string; var is renamed to x for parsing and mapped back to its own symbol"""
+    if var is None:
+        return sp.sympify(expr_str)
+    return sp.sympify(expr_str.replace(var, 'x'), locals={"x": sp.Symbol(var)})
+
+class _SympyWorker:
+    """sympy calls that may run away, made in a child process that is killed when one overruns.
+
+    A thread can't be interrupted and SIGALRM only works on the main thread, while every
+    serving path runs elsewhere. Calls are serialized; the child restarts on next use.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+    
+    def _start(self):
+        self._proc = subprocess.Popen(
+            [sys.executable, "-m", "services.math_worker"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=_BACKEND_DIR,
+        )
+        # Wait out the sympy import before any time limit applies
+        pickle.load(self._proc.stdout)
+    
+    def _kill(self):
+        self._proc.kill()
+        self._proc.wait()
+        self._proc = None
+    
+    def call(self, op: str, *args, timeout: float):
+        """Run sympy's `op` ("solve" or "integrate") on args; TimeoutError after timeout seconds"""
+        with self._lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self._start()
+            try:
+                pickle.dump((op, args), self._proc.stdin)
+                self._proc.stdin.flush()
+                ready, _, _ = select.select([self._proc.stdout], [], [], timeout)
+                if ready:
+                    ok, payload = pickle.load(self._proc.stdout)
+            except (EOFError, BrokenPipeError):
+                # The child died mid-call
+                self._kill()
+                raise
+            if not ready:
+                self._kill()
+                raise TimeoutError(f"gave up after {timeout}s")
+        if not ok:
+            raise RuntimeError(payload)
+        return payload
+
+_sympy_worker = _SympyWorker()
+
+def _char_classes(text: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per-character isalpha, isalnum and isspace masks for text.
+
+    The str predicates run once per distinct character; np.unique's inverse
+    index spreads the results back over the whole string.
+    """
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    distinct, inverse = np.unique(codepoints, return_inverse=True)
+    flags = np.array([(c.isalpha(), c.isalnum(), c.isspace()) for c in map(chr, distinct)],
+                     dtype=bool).reshape(-1, 3)[inverse]
+    return flags[:, 0], flags[:, 1], flags[:, 2]
+
+def _build_hs_database(patterns: List[str]):
+    """Compile the math patterns into a Hyperscan block-mode database; None if unavailable"""
+    if hyperscan is None:
+        return None
+    flags = hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[p.encode() for p in patterns],
+            ids=list(range(len(patterns))),
+            elements=len(patterns),
+            flags=[flags] * len(patterns),
+        )
+    except hyperscan.error:
+        return None
+    return db
 
 class VisualQAService:
     """Visual Question Answering service for math and science problems"""
     
     def __init__(self):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        if self.device == "cuda":
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.benchmark = True
         
         try:
             self.vqa_processor = BlipProcessor.from_pretrained("Salesforce/blip-vqa-base")
             self.vqa_model = BlipForQuestionAnswering.from_pretrained("Salesforce/blip-vqa-base").to(self.device)
+            self.vqa_model.eval()
         except Exception as e:
             print(f"Warning: Could not load VQA model: {e}")
             self.vqa_processor = None
             self.vqa_model = None
         
+        # Users tend to ask the same few questions, so their token ids are cached
+        self._question_ids = lru_cache(maxsize=256)(self._tokenize_question)
+        # Image enhancement scratch space; per thread, since requests are enhanced concurrently
+        self._scratch = threading.local()
+        # Cleared if tesserocr can't initialise, so later requests go straight to pytesseract
+        self._use_tesserocr = tesserocr is not None
+        
+        if self.vqa_model is not None and _QUANT_MODE != "none":
+            self._quantize_vqa_model()
+        if self.vqa_model is not None:
+            self._batch_queue: queue.Queue = queue.Queue()
+            threading.Thread(target=self._batch_worker, daemon=True).start()
+        
         # Math expression patterns
         self.math_patterns = {
             'equation': r'[a-zA-Z0-9\s]*[=][a-zA-Z0-9\s\+\-\*\/\^\.]*',
@@ -33,6 +217,12 @@ class VisualQAService:
             'exponent': r'\d+\^\d+',
             'logarithm': r'log\d*\(.*\)|ln\(.*\)'
         }
+        # Compiled once; each type is scanned on its own since their matches may overlap
+        self._math_res = [
+            (expr_type, re.compile(pattern, re.IGNORECASE))
+            for expr_type, pattern in self.math_patterns.items()
+        ]
+        self._hs_db = _build_hs_database(list(self.math_patterns.values()))
         
         # Subject-specific keywords
         self.subject_keywords = {
@@ -53,17 +243,79 @@ class VisualQAService:
             ]
         }
     
-    def process_image_question(self, image_file, question: str, subject: str = "general") -> Dict:
+    def _quantize_vqa_model(self):
+        """Quantize the VQA model's Linear weights per QUANT_MODE, keeping full precision on failure"""
+        if _QUANT_MODE == "int4" and (quantize_ is None or self.device != "cuda"):
+            print("Warning: QUANT_MODE=int4 needs CUDA and torchao; using int8 instead")
+        try:
+            if quantize_ is not None:
+                # int4 kernels need bfloat16 weights on CUDA
+                if _QUANT_MODE == "int4" and self.device == "cuda":
+                    self.vqa_model = self.vqa_model.to(torch.bfloat16)
+                    quantize_(self.vqa_model, int4_weight_only())
+                else:
+                    quantize_(self.vqa_model, int8_weight_only())
+            elif self.device == "cpu":
+                # Without torchao, fall back to the same dynamic int8 path as the text models
+                self.vqa_model = torch.ao.quantization.quantize_dynamic(
+                    self.vqa_model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            else:
+                print("Warning: Quantizing the VQA model on CUDA needs torchao; keeping full precision")
+        except Exception as e:
+            print(f"Warning: Could not quantize VQA model: {e}")
+    
+    def _compile_vqa_model(self):
+        """Compile the BLIP encoders and warm them up so the first request doesn't pay for it.
+
+        Called on the batch thread, which is the only thread that runs the model afterwards.
+        """
+        # generate() bypasses a compiled top-level module, so compile the submodules it calls.
+        # Batch size (1 to _MAX_BATCH) and question length vary per call, so compile for dynamic
+        # shapes and skip CUDA graphs, which would be re-recorded for every new shape
+        try:
+            for name in ("vision_model", "text_encoder"):
+                setattr(self.vqa_model, name, torch.compile(
+                    getattr(self.vqa_model, name), dynamic=True, fullgraph=False
+                ))
+            # Size 1 is specialized separately from the dynamic batch dimension, so warm up both
+            blank = Image.new("RGB", (384, 384), "white")
+            for size in (1, _MAX_BATCH):
+                self._generate(self._encode([blank] * size, ["What is shown?"] * size))
+        except Exception as e:
+            print(f"Warning: torch.compile failed, using the eager VQA model: {e}")
+            # This runs on the batch thread, so it must not raise
+            for name in ("vision_model", "text_encoder"):
+                module = getattr(self.vqa_model, name, None)
+                if module is not None:
+                    setattr(self.vqa_model, name, getattr(module, "_orig_mod", module))
+    
+    def process_image_question(self, image_file, question: str, subject: str = "general",
+                               include_full_text: bool = False) -> Dict:
         """Main method to process image and question"""
         try:
             # Convert uploaded file to PIL Image
             image = Image.open(image_file.stream)
             
+            # Reject images with nothing to read before paying for OCR and the VQA model;
+            # merely soft images still go through, with "low" only reported
+            sharpness = self._sharpness(image)
+            image_quality = self._quality_grade(sharpness)
+            if sharpness < _BLANK_SHARPNESS:
+                return {
+                    "error": "Image blank or too blurry to read",
+                    "confidence": 0.0,
+                    "answer": "The image looks blank or too blurry to read. Please upload a sharper, well-lit photo.",
+                    "processing_info": {"image_quality": image_quality}
+                }
+            
             # Enhance image quality for better OCR
             enhanced_image = self._enhance_image_for_ocr(image)
             
             # Extract text from image
-            extracted_text = self._extract_text_from_image(enhanced_image)
+            extracted_text_full = self._extract_text_from_image(enhanced_image)
+            # Responses show at most 500 characters, so the analysis only needs a bounded prefix
+            extracted_text = extracted_text_full[:_OCR_TEXT_LIMIT]
             
             # Detect mathematical expressions
             math_expressions = self._detect_math_expressions(extracted_text)
@@ -83,9 +335,11 @@ class VisualQAService:
                 "processing_info": {
                     "ocr_confidence": self._calculate_ocr_confidence(extracted_text),
                     "math_detected": len(math_expressions) > 0,
-                    "image_quality": self._assess_image_quality(enhanced_image)
+                    "image_quality": image_quality
                 }
             })
+            if include_full_text:
+                result["extracted_text_full"] = extracted_text_full
             
             return result
             
@@ -97,74 +351,141 @@ class VisualQAService:
             }
     
     def _enhance_image_for_ocr(self, image: Image.Image) -> Image.Image:
-        if image.mode != 'L':
-            image = image.convert('L')
+        # One grayscale array through OpenCV's vectorized ops, writing into this thread's scratch
+        # buffers instead of allocating per step; the returned image is a view of one of them
+        arr = np.asarray(image if image.mode == 'L' else image.convert('L'))
         
-        width, height = image.size
+        height, width = arr.shape
         if width < 800 or height < 600:
             scale_factor = max(800/width, 600/height)
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            image = image.resize((new_width, new_height), Image.LANCZOS)
-        
-        # Enhance contrast
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.5)
+            width = int(width * scale_factor)
+            height = int(height * scale_factor)
+        out, blur, spare = self._scratch_buffers((height, width))
+        if arr.shape != (height, width):
+            arr = cv2.resize(arr, (width, height), dst=spare, interpolation=cv2.INTER_LANCZOS4)
         
-        # Enhance sharpness
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(2.0)
+        # Enhance contrast: stretch 1.5x about the mean grey level, as ImageEnhance.Contrast does
+        mean = float(arr.mean())
+        cv2.addWeighted(arr, 1.5, arr, 0.0, -0.5 * mean, dst=out)
         
-        image = image.filter(ImageFilter.GaussianBlur(radius=0.5))
-        image = image.filter(ImageFilter.UnsharpMask())
+        # One unsharp mask (radius 1, 150%, threshold 3) in place of Sharpness + blur + UnsharpMask;
+        # the threshold leaves flat regions alone so background noise isn't amplified
+        cv2.GaussianBlur(out, (0, 0), 1.0, dst=blur)
+        cv2.addWeighted(out, 2.5, blur, -1.5, 0, dst=spare)
+        cv2.absdiff(out, blur, dst=blur)
+        cv2.compare(blur, 3, cv2.CMP_GT, dst=blur)
+        cv2.copyTo(spare, blur, out)
         
-        return image
+        return Image.frombuffer("L", (width, height), out, "raw", "L", 0, 1)
+    
+    def _scratch_buffers(self, shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Three uint8 buffers of the given shape, kept per thread and regrown only when the shape changes"""
+        buffers = getattr(self._scratch, "buffers", None)
+        if buffers is None or buffers[0].shape != shape:
+            buffers = self._scratch.buffers = tuple(np.empty(shape, np.uint8) for _ in range(3))
+        return buffers
     
     def _extract_text_from_image(self, image: Image.Image) -> str:
         """Extract text using OCR with multiple configurations"""
-        text_results = []
+        if self._use_tesserocr:
+            text_results = self._ocr_passes_tesserocr(image)
+        else:
+            text_results = self._ocr_passes_pytesseract(image)
         
+        best_text = max(text_results, key=len, default="")
+        return best_text.strip()
+    
+    def _ocr_passes_tesserocr(self, image: Image.Image) -> List[str]:
+        """All OCR passes through one in-process engine, loading the model and the pixel buffer once"""
         try:
-            config1 = '--oem 3 --psm 6'
-            text1 = pytesseract.image_to_string(image, config=config1)
-            text_results.append(text1)
-        except Exception:
-            pass
+            api = tesserocr.PyTessBaseAPI(oem=OEM.DEFAULT)
+        except RuntimeError as e:
+            # Typically missing tessdata or language files; the tesseract binary may still work
+            print(f"Warning: tesserocr unavailable ({e}); falling back to pytesseract")
+            self._use_tesserocr = False
+            return self._ocr_passes_pytesseract(image)
         
-        try:
-            config2 = '--oem 3 --psm 8 -c tessedit_char_whitelist=0123456789+-*/=()[]{}abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.,√∫∑∂∞≤≥≠±'
-            text2 = pytesseract.image_to_string(image, config=config2)
-            text_results.append(text2)
-        except Exception:
-            pass
+        text_results = []
+        with api:
+            # Hand over the raw 8-bit grey pixels; SetImage would re-encode the PIL image first
+            pixels = np.ascontiguousarray(np.asarray(image if image.mode == 'L' else image.convert('L')))
+            height, width = pixels.shape
+            raw = pixels.tobytes()
+            for psm, whitelist in _OCR_PASSES:
+                try:
+                    # Tesseract keeps its last recognition until a new image is set, so each
+                    # pass re-sets the (already encoded) buffer to force a fresh one
+                    api.SetImageBytes(raw, width, height, 1, width)
+                    api.SetPageSegMode(psm)
+                    api.SetVariable("tessedit_char_whitelist", whitelist)
+                    text_results.append(api.GetUTF8Text())
+                except Exception:
+                    text_results.append("")
+        return text_results
+    
+    def _ocr_passes_pytesseract(self, image: Image.Image) -> List[str]:
+        """All OCR passes as concurrent tesseract subprocesses over one encoded image file"""
+        def run(config: str) -> str:
+            try:
+                return pytesseract.image_to_string(path, config=config)
+            except Exception:
+                return ""
         
-        try:
-            config3 = '--oem 3 --psm 7'
-            text3 = pytesseract.image_to_string(image, config=config3)
-            text_results.append(text3)
-        except Exception:
-            pass
+        configs = [f"--oem 3 --psm {psm}" + (f" -c tessedit_char_whitelist={whitelist}" if whitelist else "")
+                   for psm, whitelist in _OCR_PASSES]
+        with tempfile.TemporaryDirectory() as tmp:
+            # Write once rather than letting pytesseract encode a fresh PNG per pass; an
+            # uncompressed BMP also skips the zlib round trip
+            path = os.path.join(tmp, "ocr.bmp")
+            image.save(path)
+            with ThreadPoolExecutor(max_workers=len(configs)) as pool:
+                return list(pool.map(run, configs))
+    
+    def _detect_math_expressions(self, text: str, limit: int = 5) -> List[Dict]:
+        """Detect mathematical expressions in text; the `limit` most confident, best first"""
+        # Parallel per-match columns; dicts are only built for the rows returned
+        types: List[str] = []
+        matches: List[re.Match] = []
+        confs: List[float] = []
         
-        best_text = max(text_results, key=len, default="")
-        return best_text.strip()
+        hits = self._math_candidates(text)
+        for i, (expr_type, pattern) in enumerate(self._math_res):
+            if hits is not None and i not in hits:
+                continue
+            for match in pattern.finditer(text):
+                types.append(expr_type)
+                matches.append(match)
+                confs.append(self._calculate_expression_confidence(match.group(), expr_type))
+        
+        # Sort by confidence; stable, so ties keep pattern then position order
+        order = np.argsort(-np.array(confs), kind="stable")[:limit]
+        return [
+            {
+                "type": types[j],
+                "expression": matches[j].group().strip(),
+                "position": matches[j].span(),
+                "confidence": confs[j]
+            }
+            for j in order
+        ]
     
-    def _detect_math_expressions(self, text: str) -> List[Dict]:
-        """Detect mathematical expressions in text"""
-        expressions = []
+    def _math_candidates(self, text: str) -> Optional[Set[int]]:
+        """Indices of math patterns matching anywhere in text, from one Hyperscan pass.
+
+        Hyperscan reports every match end rather than re's leftmost non-overlapping
+        spans, so this only decides which patterns ``finditer`` still has to run.
+        Returns None when Hyperscan is unavailable.
+        """
+        if self._hs_db is None:
+            return None
         
-        for expr_type, pattern in self.math_patterns.items():
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
-                expressions.append({
-                    "type": expr_type,
-                    "expression": match.group().strip(),
-                    "position": match.span(),
-                    "confidence": self._calculate_expression_confidence(match.group(), expr_type)
-                })
+        hits: Set[int] = set()
         
-        # Sort by confidence
-        expressions.sort(key=lambda x: x["confidence"], reverse=True)
-        return expressions
+        def on_match(pattern_id, start, end, flags, context):
+            hits.add(pattern_id)
+        
+        self._hs_db.scan(text.encode(), match_event_handler=on_match)
+        return hits
     
     def _process_stem_question(self, image: Image.Image, enhanced_image: Image.Image, 
                               question: str, extracted_text: str, math_expressions: List[Dict], 
@@ -234,15 +555,15 @@ class VisualQAService:
             else:
                 expr = equation
             
-            variables = re.findall(r'[a-zA-Z]', equation)
+            variables = _LETTER_RE.findall(equation)
             if not variables:
                 return {"solution": "No variables found to solve for", "confidence": 0.2}
             
             var = max(set(variables), key=variables.count)
             
             x = sp.Symbol(var)
-            eq = sp.sympify(expr.replace(var, 'x'))
-            solutions = sp.solve(eq, x)
+            eq = _parse(expr, var)
+            solutions = _sympy_worker.call("solve", eq, x, timeout=_SOLVE_TIMEOUT_S)
             
             if solutions:
                 if len(solutions) == 1:
@@ -269,7 +590,7 @@ class VisualQAService:
     def _solve_derivative(self, expression: str) -> Dict:
         """Solve derivative problems"""
         try:
-            match = re.search(r'd([^/]+)/d([a-zA-Z])', expression)
+            match = _DERIVATIVE_RE.search(expression)
             if not match:
                 return {"solution": "Could not parse derivative", "confidence": 0.2}
             
@@ -277,7 +598,7 @@ class VisualQAService:
             var = match.group(2)
             
             x = sp.Symbol(var)
-            func = sp.sympify(func_str.replace(var, 'x'))
+            func = _parse(func_str, var)
             derivative = sp.diff(func, x)
             
             return {
@@ -296,7 +617,7 @@ class VisualQAService:
     def _solve_integral(self, expression: str) -> Dict:
         """Solve integral problems"""
         try:
-            integrand_match = re.search(r'∫([^d]+)d([a-zA-Z])', expression)
+            integrand_match = _INTEGRAL_RE.search(expression)
             if not integrand_match:
                 return {"solution": "Could not parse integral", "confidence": 0.2}
             
@@ -304,8 +625,8 @@ class VisualQAService:
             var = integrand_match.group(2)
             
             x = sp.Symbol(var)
-            func = sp.sympify(integrand.replace(var, 'x'))
-            integral = sp.integrate(func, x)
+            func = _parse(integrand, var)
+            integral = _sympy_worker.call("integrate", func, x, timeout=_SOLVE_TIMEOUT_S)
             
             return {
                 "solution": f"∫{integrand}d{var} = {integral} + C",
@@ -323,8 +644,9 @@ class VisualQAService:
     def _evaluate_expression(self, expression: str) -> Dict:
         """Evaluate mathematical expressions"""
         try:
-            result = sp.sympify(expression)
-            simplified = sp.simplify(result)
+            result = _parse(expression)
+            # cancel() normalizes fractions and polynomials for display at a fraction of simplify()'s cost
+            simplified = result if result.is_Atom else sp.cancel(result)
             
             return {
                 "solution": f"{expression} = {simplified}",
@@ -341,32 +663,25 @@ class VisualQAService:
     
     def _clean_math_expression(self, expression: str) -> str:
         """Clean mathematical expression for parsing"""
-        replacements = {
-            '×': '*',
-            '÷': '/',
-            '−': '-',
-            '±': '+-',
-            '²': '**2',
-            '³': '**3',
-        }
-        
-        cleaned = expression
-        for old, new in replacements.items():
-            cleaned = cleaned.replace(old, new)
-
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
+        cleaned = expression.translate(_MATH_SYMBOLS)
+        cleaned = _WS_RE.sub(' ', cleaned).strip()
         
         return cleaned
     
+    def _generate(self, inputs) -> torch.Tensor:
+        """Run VQA generation; BF16 autocast on GPU, plain FP32 on CPU"""
+        autocast = (torch.autocast("cuda", dtype=torch.bfloat16)
+                    if self.device == "cuda" else nullcontext())
+        with torch.inference_mode(), autocast:
+            return self.vqa_model.generate(**inputs, max_length=50, num_beams=1)
+    
     def _get_vqa_answer(self, image: Image.Image, question: str) -> Dict:
         """Get answer using visual question answering model"""
         try:
-            inputs = self.vqa_processor(image, question, return_tensors="pt").to(self.device)
-            
-            with torch.no_grad():
-                outputs = self.vqa_model.generate(**inputs, max_length=50)
-            
-            answer = self.vqa_processor.decode(outputs[0], skip_special_tokens=True)
+            # Concurrent callers are coalesced into one batched generate by the worker thread
+            future: Future = Future()
+            self._batch_queue.put((image, question, future))
+            answer = future.result()
             
             confidence = min(0.9, len(answer.split()) / 10 + 0.3)
             
@@ -380,6 +695,62 @@ class VisualQAService:
             print(f"VQA model error: {e}")
             return {"answer": "", "confidence": 0.0}
     
+    def _batch_worker(self):
+        """Collect VQA requests for up to _BATCH_WINDOW_S (at most _MAX_BATCH) and answer them together.
+
+        Batch shapes vary with load; when compiling, the warm-up batches also keep
+        cudnn.benchmark's autotuning off the first real requests.
+        """
+        # Compiled here rather than in __init__ so warm-up happens on the thread that serves;
+        # requests queued meanwhile wait for it
+        if _USE_TORCH_COMPILE and hasattr(torch, "compile"):
+            self._compile_vqa_model()
+        while True:
+            batch = [self._batch_queue.get()]
+            deadline = time.monotonic() + _BATCH_WINDOW_S
+            while len(batch) < _MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._batch_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            images, questions, futures = zip(*batch)
+            try:
+                answers = self._answer_batch(list(images), list(questions))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, answer in zip(futures, answers):
+                future.set_result(answer)
+    
+    def _encode(self, images: List[Image.Image], questions: List[str]) -> Dict[str, torch.Tensor]:
+        """Model inputs for a batch: fresh pixel values, cached question token ids padded together"""
+        # The image processor resizes every image to BLIP's 384x384 input, so only the questions need padding
+        pixels = self.vqa_processor.image_processor(
+            [image.convert("RGB") for image in images], return_tensors="pt"
+        )
+        text = self.vqa_processor.tokenizer.pad(
+            {"input_ids": [list(self._question_ids(q)) for q in questions]},
+            padding=True, return_tensors="pt"
+        )
+        return {
+            "pixel_values": pixels["pixel_values"].to(self.device),
+            "input_ids": text["input_ids"].to(self.device),
+            "attention_mask": text["attention_mask"].to(self.device),
+        }
+    
+    def _tokenize_question(self, question: str) -> Tuple[int, ...]:
+        return tuple(self.vqa_processor.tokenizer(question)["input_ids"])
+    
+    def _answer_batch(self, images: List[Image.Image], questions: List[str]) -> List[str]:
+        """Answer several image/question pairs with one padded generate call"""
+        outputs = self._generate(self._encode(images, questions))
+        return self.vqa_processor.batch_decode(outputs, skip_special_tokens=True)
+    
     def _rule_based_stem_analysis(self, question: str, extracted_text: str, 
                                  math_expressions: List[Dict], subject: str) -> Dict:
         """Rule-based analysis for STEM questions"""
@@ -415,10 +786,17 @@ class VisualQAService:
                 "confidence": 0.1
             }
         
-        question_words = set(question.lower().split())
-        text_words = set(extracted_text.lower().split())
+        question_words = frozenset(question.casefold().split())
         
-        overlap = len(question_words.intersection(text_words))
+        # Count distinct question words found in the text, without building a set of the text;
+        # stop as soon as every question word has turned up
+        unseen = set(question_words)
+        for word in extracted_text.casefold().split():
+            if word in unseen:
+                unseen.discard(word)
+                if not unseen:
+                    break
+        overlap = len(question_words) - len(unseen)
         
         if overlap > 0:
             return {
@@ -471,7 +849,7 @@ class VisualQAService:
                 confidence += 0.2
         
         # Avoid common OCR mistakes
-        if not re.search(r'[|\\]{2,}', expression):  # No multiple pipes/backslashes
+        if not _OCR_ARTIFACT_RE.search(expression):  # No multiple pipes/backslashes
             confidence += 0.1
         
         return min(1.0, confidence)
@@ -483,33 +861,179 @@ class VisualQAService:
         
         confidence = 0.5
         
-        # Check for reasonable word/character ratios
-        words = text.split()
-        if words:
-            avg_word_length = sum(len(word) for word in words) / len(words)
+        alpha, alnum, space = _char_classes(text)
+        n = len(text)
+        
+        # Check for reasonable word/character ratios; words are the runs of non-space characters
+        non_space = ~space
+        word_count = np.count_nonzero(non_space[1:] & space[:-1]) + bool(non_space[0])
+        if word_count:
+            avg_word_length = np.count_nonzero(non_space) / word_count
             if 2 <= avg_word_length <= 12:  # Reasonable average word length
                 confidence += 0.2
         
         # Check for reasonable character distribution
-        alpha_ratio = sum(c.isalpha() for c in text) / len(text)
+        alpha_ratio = np.count_nonzero(alpha) / n
         if 0.3 <= alpha_ratio <= 0.9:  # Good mix of letters
             confidence += 0.2
         
         # Penalty for excessive special characters (OCR artifacts)
-        special_ratio = sum(not c.isalnum() and not c.isspace() for c in text) / len(text)
+        special_ratio = np.count_nonzero(~alnum & non_space) / n
         if special_ratio > 0.3:
             confidence -= 0.3
         
         return max(0.0, min(1.0, confidence))
     
     def _assess_image_quality(self, image: Image.Image) -> str:
-        """Assess image quality for OCR"""
-        width, height = image.size
-        
-        # Size assessment
-        if width < 400 or height < 300:
+        """Assess image quality for OCR by sharpness"""
+        return self._quality_grade(self._sharpness(image))
+    
+    def _sharpness(self, image: Image.Image) -> float:
+        """Variance of the grey-level Laplacian, measured at a fixed working size.
+
+        Downscaling first keeps the score independent of resolution: the same page
+        photographed at 4032x3024 or 1920x1080 grades the same.
+        """
+        arr = np.asarray(image if image.mode == 'L' else image.convert('L'))
+        height, width = arr.shape
+        scale = _SHARPNESS_SIDE / max(height, width)
+        if scale < 1:
+            arr = cv2.resize(arr, (max(1, round(width * scale)), max(1, round(height * scale))),
+                             interpolation=cv2.INTER_AREA)
+        return float(cv2.Laplacian(arr, cv2.CV_32F).var())
+    
+    def _quality_grade(self, sharpness: float) -> str:
+        if sharpness < 50:
             return "low"
-        elif width > 1200 and height > 800:
+        elif sharpness > 500:
             return "high"
         else:
-            return "medium"
\ No newline at end of file
+            return "medium"
+
+@lru_cache(maxsize=1)
+def get_service() -> VisualQAService:
+    """The shared VisualQAService, so the BLIP weights load once per process"""
+    return VisualQAService()
+
+
+def _worker_main(tasks, results, threads: int):
+    """Entry point of a VQA worker process: answer queued requests on `threads` threads at once.
+
+    Running requests concurrently is what lets the service's batch thread coalesce
+    their VQA calls; one request at a time would always give batches of one.
+    """
+    service = get_service()
+    
+    def run(task_id: int, image_bytes: bytes, question: str, subject: str):
+        try:
+            upload = SimpleNamespace(stream=io.BytesIO(image_bytes))
+            results.put((task_id, True, service.process_image_question(upload, question, subject)))
+        except Exception as e:
+            results.put((task_id, False, repr(e)))
+    
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for task in iter(tasks.get, None):
+            pool.submit(run, *task)
+
+
+class _VQAWorkerPool:
+    """Worker processes sharing one task queue; each loads its own VisualQAService"""
+    
+    def __init__(self, processes: int, threads: int):
+        # spawn, not fork: a forked child can't initialise CUDA
+        ctx = multiprocessing.get_context("spawn")
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.broken = False
+        self._closing = False
+        self._processes = [
+            ctx.Process(target=_worker_main, args=(self._tasks, self._results, threads), daemon=True)
+            for _ in range(processes)
+        ]
+        for process in self._processes:
+            process.start()
+        threading.Thread(target=self._collect, daemon=True).start()
+    
+    def submit(self, image_bytes: bytes, question: str, subject: str) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self.broken:
+                raise BrokenProcessPool("A VQA worker process exited unexpectedly")
+            task_id = self._next_id
+            self._next_id += 1
+            self._pending[task_id] = future
+        self._tasks.put((task_id, image_bytes, question, subject))
+        return future
+    
+    def _collect(self):
+        while True:
+            try:
+                task_id, ok, payload = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if self._closing:
+                    return
+                # A dead worker takes its in-flight requests with it, and there's no telling
+                # which ones they were, so fail everything pending (as ProcessPoolExecutor does)
+                if any(not p.is_alive() for p in self._processes):
+                    self._fail_pending()
+                    return
+                continue
+            with self._lock:
+                future = self._pending.pop(task_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+    
+    def _fail_pending(self):
+        with self._lock:
+            self.broken = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(BrokenProcessPool("A VQA worker process exited unexpectedly"))
+        for process in self._processes:
+            process.terminate()
+    
+    def close(self):
+        """Stop the workers once they've finished the requests already queued"""
+        self._closing = True
+        if self.broken:
+            return
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join()
+
+
+_pool: Optional[_VQAWorkerPool] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> _VQAWorkerPool:
+    global _pool
+    # Locked: concurrent first requests must not each start their own set of workers
+    with _pool_lock:
+        # A pool that lost a worker is replaced rather than left failing every request
+        if _pool is None or _pool.broken:
+            _pool = _VQAWorkerPool(_VQA_WORKERS, _MAX_BATCH)
+        return _pool
+
+def close_pool():
+    """Shut down the answer_image_question workers, if they were started"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def answer_image_question(image_file, question: str, subject: str = "general") -> Dict:
+    """process_image_question in a worker process, so OCR and model inference run outside this process's GIL.
+
+    The upload travels as raw bytes rather than a pickled PIL image.
+    """
+    image_bytes = image_file.stream.read()
+    return _get_pool().submit(image_bytes, question, subject).result(timeout=_VQA_REQUEST_TIMEOUT_S)
@@ -0,0 +1,14 @@
+import pytest
+
+from services.flashcards import extract_flashcards
+
+
+@pytest.mark.parametrize("text, term", [
+    # IGNORECASE folds İ and ı into [A-Za-z]; the Hyperscan prefilter must not drop these
+    ("İnflation is a rise in prices.", "İnflation"),
+    ("Iıdent is a word.", "Iıdent"),
+    # Lone surrogates must not break the prefilter's UTF-8 encoding
+    ("Energy is the capacity \udc80 to do work.", "Energy"),
+])
+def test_definition_prefilter_matches_re_patterns(text, term):
+    assert [card["term"] for card in extract_flashcards(text)] == [term]
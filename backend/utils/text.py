@@ -1,8 +1,11 @@
 import re
 from typing import List
 
+_SENT_SPLIT = re.compile(r'(?<=[.!?])\s+')
+_WS = re.compile(r"\s+")
+
 def sentences(text: str) -> List[str]:
-    return re.split(r'(?<=[.!?])\s+', (text or "").strip())
+    return _SENT_SPLIT.split((text or "").strip())
 
 def normalize_space(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "").strip())
+    return _WS.sub(" ", (s or "").strip())